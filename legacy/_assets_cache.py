@@ -0,0 +1,142 @@
+"""Keeps fetched database assets on disk, so they are not requested from Telegram again."""
+
+import hashlib
+import logging
+import os
+import struct
+import threading
+import time
+import typing
+
+logger = logging.getLogger(__name__)
+
+MAX_FILESIZE = 1024 * 1024 * 1  # 1 MB
+MAX_TOTALSIZE = 1024 * 1024 * 50  # 50 MB
+# Entries older than that are fetched from Telegram again, so deleted
+# and edited assets are not served forever
+MAX_AGE = 24 * 60 * 60
+
+# Entry starts with the time it was saved at
+_HEADER = struct.Struct("<d")
+
+
+class AssetsCache:
+    """
+    Size-bounded cache of serialized asset messages.
+    Least recently used entries are evicted once the cache grows larger than `max_size`.
+    Methods do blocking file I/O and are safe to call from executor threads.
+    """
+
+    def __init__(
+        self,
+        base_path: typing.Union[str, os.PathLike],
+        tg_id: int,
+        max_size: int = MAX_TOTALSIZE,
+        max_age: float = MAX_AGE,
+    ):
+        self._path = os.path.join(base_path, "assets_cache", str(tg_id))
+        self._max_size = max_size
+        self._max_age = max_age
+        self._lock = threading.Lock()
+        self._ensure_dirs()
+        self._size = self._total_size
+
+    @property
+    def _total_size(self) -> int:
+        return sum(os.path.getsize(f.path) for f in os.scandir(self._path))
+
+    def _ensure_dirs(self):
+        """Ensures that the cache directory exists."""
+        if not os.path.isdir(self._path):
+            os.makedirs(self._path)
+
+    def _get_path(self, channel_id: int, asset_id: int) -> str:
+        return os.path.join(
+            self._path,
+            hashlib.sha256(f"{channel_id}_{asset_id}".encode()).hexdigest(),
+        )
+
+    def _evict(self):
+        """Removes least recently used entries until cache fits into the limit."""
+        entries = sorted(os.scandir(self._path), key=lambda f: f.stat().st_mtime)
+        for entry in entries:
+            if self._size <= self._max_size:
+                break
+
+            size = entry.stat().st_size
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+
+            self._size -= size
+
+    def save(self, channel_id: int, asset_id: int, data: bytes):
+        """
+        Saves asset to cache.
+        :param channel_id: ID of the assets channel.
+        :param asset_id: Asset ID.
+        :param data: Serialized asset.
+        """
+        if len(data) > MAX_FILESIZE:
+            logger.debug("Asset %s is too large to be cached", asset_id)
+            return
+
+        data = _HEADER.pack(time.time()) + data
+        path = self._get_path(channel_id, asset_id)
+        with self._lock:
+            if os.path.isfile(path):
+                self._size -= os.path.getsize(path)
+
+            with open(path, "wb") as f:
+                f.write(data)
+
+            self._size += len(data)
+
+            if self._size > self._max_size:
+                self._evict()
+
+    def fetch(self, channel_id: int, asset_id: int) -> typing.Optional[bytes]:
+        """
+        Fetches asset from cache and marks it as recently used.
+        :param channel_id: ID of the assets channel.
+        :param asset_id: Asset ID.
+        :return: Serialized asset or None if it's not cached or outdated.
+        """
+        path = self._get_path(channel_id, asset_id)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+
+        if (
+            len(data) < _HEADER.size
+            or time.time() - _HEADER.unpack_from(data)[0] > self._max_age
+        ):
+            self.remove(channel_id, asset_id)
+            return None
+
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            # Evicted by another thread meanwhile
+            pass
+
+        return data[_HEADER.size :]
+
+    def remove(self, channel_id: int, asset_id: int):
+        """
+        Removes asset from cache.
+        :param channel_id: ID of the assets channel.
+        :param asset_id: Asset ID.
+        """
+        path = self._get_path(channel_id, asset_id)
+        with self._lock:
+            try:
+                size = os.path.getsize(path)
+                os.remove(path)
+            except FileNotFoundError:
+                return
+
+            self._size -= size
@@ -0,0 +1,248 @@
+"""`| grep` filter for command output"""
+
+import html
+import itertools
+import re
+import typing
+
+# Tags and HTML entities, everything between them is plain text.
+# Markup never spans lines, so plain text has the same lines as original one
+_TAGS = re.compile(r"<[^>\n]*>")
+_ENTITIES = re.compile(r"&(?:#\d+|#[xX][0-9a-fA-F]+|[a-zA-Z]\w*);")
+_RARE_ENTITIES = re.compile(
+    r"&(?!(?:amp|lt|gt|quot|#39);)(?:#\d+|#[xX][0-9a-fA-F]+|[a-zA-Z]\w*);"
+)
+_MARKUP = re.compile(f"{_TAGS.pattern}|{_ENTITIES.pattern}")
+
+_FLAGS = re.compile(r"-[icnv]+")
+_MAX_COUNT = re.compile(r"-m(\d*)")
+
+
+class _Run(typing.NamedTuple):
+    start: int  # In plain text
+    end: int
+    markup: str  # Original text of run
+    text: bool  # Whether run is plain text, which can be split
+
+
+def _unescape(entity: str) -> str:
+    value = html.unescape(entity)
+    return entity if "\n" in value else value
+
+
+def _strip(text: str) -> str:
+    """
+    Strip markup of the whole text at once
+    :param text: Text with HTML markup
+    :return: Plain text with the same lines
+    """
+    text = _TAGS.sub("", text)
+    if "&" not in text:
+        return text
+
+    if _RARE_ENTITIES.search(text):
+        return _ENTITIES.sub(lambda m: _unescape(m.group(0)), text)
+
+    # Only entities, produced by `utils.escape_html`, are left
+    return (
+        text.replace("&lt;", "<")
+        .replace("&gt;", ">")
+        .replace("&quot;", '"')
+        .replace("&#39;", "'")
+        .replace("&amp;", "&")
+    )
+
+
+def _tokenize(line: str) -> typing.Tuple[str, typing.List[_Run]]:
+    """
+    Strip tags and unescape entities in a single pass
+    :param line: Line with HTML markup
+    :return: Plain text and runs, which map it back to markup
+    """
+    plain = []
+    runs = []
+    offset = 0
+    last = 0
+
+    def add(markup: str, text: str, is_text: bool):
+        nonlocal offset
+        plain.append(text)
+        runs.append(_Run(offset, offset + len(text), markup, is_text))
+        offset += len(text)
+
+    for match in _MARKUP.finditer(line):
+        if match.start() > last:
+            chunk = line[last : match.start()]
+            add(chunk, chunk, True)
+
+        token = match.group(0)
+        add(token, "" if token[0] == "<" else _unescape(token), False)
+        last = match.end()
+
+    if last < len(line):
+        chunk = line[last:]
+        add(chunk, chunk, True)
+
+    return "".join(plain), runs
+
+
+class Grep:
+    """
+    Compiled `| grep` stage. Pattern is matched literally against text
+    of each line without markup
+    """
+
+    def __init__(
+        self,
+        pattern: str,
+        ignore_case: bool = False,
+        invert: bool = False,
+        count: bool = False,
+        line_numbers: bool = False,
+        max_count: typing.Optional[int] = None,
+    ):
+        self.pattern = pattern
+        self.invert = invert
+        self.count = count
+        self.line_numbers = line_numbers
+        self.max_count = max_count
+        self._regex = (
+            re.compile(re.escape(pattern), re.IGNORECASE if ignore_case else 0)
+            if pattern
+            else None
+        )
+
+    @classmethod
+    def parse(cls, args: str) -> "Grep":
+        """
+        Parse grep arguments, e.g. `-in -m 5 pattern`. Options are recognized
+        until `--`, everything else is the pattern
+        :param args: Raw arguments
+        :return: Compiled grep
+        """
+        flags = set()
+        max_count = None
+        pattern = []
+        tokens = args.strip().split(" ")
+        i = 0
+        while i < len(tokens):
+            token = tokens[i]
+            i += 1
+            if token == "--":
+                pattern.extend(tokens[i:])
+                break
+
+            if _FLAGS.fullmatch(token):
+                flags.update(token[1:])
+            elif (match := _MAX_COUNT.fullmatch(token)) and (
+                match.group(1) or i < len(tokens) and tokens[i].isdigit()
+            ):
+                if not match.group(1):
+                    i += 1
+
+                max_count = int(match.group(1) or tokens[i - 1])
+            else:
+                pattern.append(token)
+
+        return cls(
+            " ".join(pattern).strip(),
+            ignore_case="i" in flags,
+            invert="v" in flags,
+            count="c" in flags,
+            line_numbers="n" in flags,
+            max_count=max_count,
+        )
+
+    def _highlight(self, line: str) -> str:
+        if "<" in line or "&" in line:
+            plain, runs = _tokenize(line)
+        else:
+            plain, runs = line, [_Run(0, len(line), line, True)]
+
+        spans = [m.span() for m in self._regex.finditer(plain) if m.end() > m.start()]
+        if not spans:
+            return line
+
+        result = []
+        span = 0
+        for run in runs:
+            while span < len(spans) and spans[span][1] <= run.start:
+                span += 1
+
+            if span == len(spans) or spans[span][0] >= run.end or run.start == run.end:
+                result.append(run.markup)
+                continue
+
+            if not run.text:
+                # Entity can't be split, so it's highlighted as a whole
+                result.append(f"<u><i>{run.markup}</i></u>")
+                continue
+
+            position = run.start
+            for start, end in spans[span:]:
+                if start >= run.end:
+                    break
+
+                start, end = max(start, run.start), min(end, run.end)
+                result.append(run.markup[position - run.start : start - run.start])
+                result.append(
+                    f"<u><i>{run.markup[start - run.start : end - run.start]}</i></u>"
+                )
+                position = end
+
+            result.append(run.markup[position - run.start :])
+
+        return "".join(result)
+
+    def _matching_lines(self, plain: str) -> typing.Iterator[int]:
+        """
+        Find lines with pattern by searching the whole text, so lines without
+        matches are skipped at regex speed
+        :param plain: Text without markup
+        :return: Numbers of matching lines, starting from 1, in ascending order
+        """
+        number = 1
+        position = 0
+        while match := self._regex.search(plain, position):
+            number += plain.count("\n", position, match.start())
+            yield number
+
+            position = plain.find("\n", match.end())
+            if position == -1:
+                return
+
+    def __call__(self, text: str) -> str:
+        """
+        Filter text
+        :param text: HTML text
+        :return: Selected lines or their count. Empty string if nothing is selected
+        """
+        lines = text.split("\n")
+        if self._regex is None:
+            numbers = iter(()) if self.invert else iter(range(1, len(lines) + 1))
+        else:
+            numbers = self._matching_lines(
+                _strip(text) if "<" in text or "&" in text else text
+            )
+            if self.invert:
+                matching = set(numbers)
+                numbers = (
+                    number
+                    for number in range(1, len(lines) + 1)
+                    if number not in matching
+                )
+
+        numbers = itertools.islice(numbers, self.max_count)
+        if self.count:
+            return str(sum(1 for _ in numbers))
+
+        highlight = self._regex is not None and not self.invert
+        selected = []
+        for number in numbers:
+            line = lines[number - 1]
+            if highlight:
+                line = self._highlight(line)
+
+            selected.append(f"{number}:{line}" if self.line_numbers else line)
+
+        return "\n".join(selected)
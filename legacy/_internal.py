@@ -46,6 +46,10 @@ def restart():
         )
         sys.exit(0)
 
+    # Process is going to be replaced, so atexit hooks won't run
+    if (database := sys.modules.get(f"{__package__}.database")) is not None:
+        database.flush_all()
+
     logging.getLogger().setLevel(logging.CRITICAL)
 
     if "HIKKA_DO_NOT_RESTART" not in os.environ:
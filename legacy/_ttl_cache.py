@@ -0,0 +1,139 @@
+"""Size-bounded cache with expiring entries and deduplicated fetches"""
+
+import asyncio
+import collections
+import logging
+import time
+import typing
+
+logger = logging.getLogger(__name__)
+
+
+class _Entry:
+    __slots__ = ("value", "fresh_until", "stale_until")
+
+    def __init__(self, value: typing.Any, fresh_until: float, stale_until: float):
+        self.value = value
+        self.fresh_until = fresh_until
+        self.stale_until = stale_until
+
+
+class TTLCache:
+    """
+    Least recently used entries are evicted once cache holds more than `max_size`
+    of them. Entries are fresh for `ttl` seconds and then can be served for
+    `stale` more seconds, while they are refetched in background. Concurrent
+    fetches of the same key are merged into one
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: float = 5 * 60, stale: float = 60):
+        self._max_size = max_size
+        self._ttl = ttl
+        self._stale = stale
+        self._entries: "collections.OrderedDict[typing.Hashable, _Entry]" = (
+            collections.OrderedDict()
+        )
+        self._inflight: typing.Dict[typing.Hashable, asyncio.Future] = {}
+        self._tasks: typing.Set[asyncio.Task] = set()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: typing.Hashable, default: typing.Any = None) -> typing.Any:
+        """
+        Get fresh value without fetching it
+        :param key: Key
+        :param default: Value to return, if there is no fresh entry
+        :return: Cached value or default
+        """
+        entry = self._entries.get(key)
+        if entry is None or entry.fresh_until < time.monotonic():
+            return default
+
+        self._entries.move_to_end(key)
+        return entry.value
+
+    def set(
+        self,
+        key: typing.Hashable,
+        value: typing.Any,
+        ttl: typing.Optional[float] = None,
+    ):
+        """
+        Save value
+        :param key: Key
+        :param value: Value
+        :param ttl: Time in seconds, during which value is fresh. Defaults to cache TTL
+        """
+        fresh_until = time.monotonic() + (self._ttl if ttl is None else ttl)
+        self._entries[key] = _Entry(value, fresh_until, fresh_until + self._stale)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._max_size:
+            self._entries.popitem(last=False)
+
+    def pop(self, key: typing.Hashable):
+        self._entries.pop(key, None)
+
+    async def get_or_fetch(
+        self,
+        key: typing.Hashable,
+        fetch: typing.Callable[[], typing.Awaitable],
+    ) -> typing.Any:
+        """
+        Get cached value or fetch it. Stale value is returned right away
+        and refreshed in background
+        :param key: Key
+        :param fetch: Function, which returns coroutine, resolving to value
+        :return: Value
+        """
+        if (entry := self._entries.get(key)) is not None:
+            now = time.monotonic()
+            if entry.stale_until >= now:
+                self._entries.move_to_end(key)
+                if entry.fresh_until < now:
+                    self._revalidate(key, fetch)
+
+                return entry.value
+
+        return await self._fetch(key, fetch)
+
+    async def _fetch(
+        self,
+        key: typing.Hashable,
+        fetch: typing.Callable[[], typing.Awaitable],
+    ) -> typing.Any:
+        if (future := self._inflight.get(key)) is not None:
+            return await asyncio.shield(future)
+
+        future = self._inflight[key] = asyncio.get_running_loop().create_future()
+        # Nobody may wait for the result, so exception is marked as retrieved
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        try:
+            value = await fetch()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            self.set(key, value)
+            future.set_result(value)
+            return value
+        finally:
+            del self._inflight[key]
+
+    def _revalidate(
+        self,
+        key: typing.Hashable,
+        fetch: typing.Callable[[], typing.Awaitable],
+    ):
+        if key in self._inflight:
+            return
+
+        async def refresh():
+            try:
+                await self._fetch(key, fetch)
+            except Exception:
+                logger.debug("Unable to refresh %s", key, exc_info=True)
+
+        task = asyncio.ensure_future(refresh())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
@@ -0,0 +1,370 @@
+"""Offline benchmark of per-event work in `CommandDispatcher`
+
+Compares new messages, censored and parsed separately by command and watcher
+paths, the way they were handled before, with messages, parsed once and shared
+by both of them
+
+Usage: python -m legacy.benchmarks.dispatcher [--watchers 10 50]
+    [--iterations 2000] [--output results.json]
+"""
+
+import argparse
+import asyncio
+import datetime
+import functools
+import json
+import platform
+import random
+import sys
+import tempfile
+import time
+import typing
+from pathlib import Path
+
+if typing.TYPE_CHECKING:
+    from ..dispatcher import CommandDispatcher, DispatcherSettings, EventContext
+
+DEFAULT_WATCHERS = (10, 50)
+DEFAULT_ITERATIONS = 2000
+ME = 1000
+# Share of messages, which start with command prefix
+COMMANDS_SHARE = 0.2
+WORDS = ("hello", "world", "legacy", "test")
+
+
+class StubEntityCache:
+    def get(self, _: int):
+        return None
+
+
+class StubMe:
+    id = ME
+    username = "me"
+    usernames = None
+
+
+class StubLoader:
+    """Stands in for `Modules` as seen by `SecurityManager`"""
+
+    commands = {}
+
+    def find_alias(self, alias: str, include_legacytl: bool = False) -> None:
+        return None
+
+
+class StubClient:
+    """Stands in for `CustomTelegramClient` with only attributes dispatcher reads"""
+
+    tg_id = ME
+    _self_id = ME
+    parse_mode = None
+    legacy_me = StubMe()
+    loader = StubLoader()
+    _mb_entity_cache = StubEntityCache()
+
+
+class StubModules:
+    """Stands in for `Modules` with given commands and watchers"""
+
+    def __init__(
+        self,
+        commands: typing.Dict[str, callable],
+        watchers: typing.List[callable],
+    ):
+        self.commands = commands
+        self.watchers = watchers
+
+    def dispatch(self, command: str) -> typing.Tuple[str, typing.Optional[callable]]:
+        return command, self.commands.get(command)
+
+
+def build_commands() -> typing.Dict[str, callable]:
+    """
+    Create module with commands for each word, messages are made of.
+    Commands are available in groups and private chats, so security check
+    passes without requests
+    :return: Bound commands by their names
+    """
+    from .. import security
+
+    module = type("CommandsModule", (), {"strings": {"name": "CommandsModule"}})
+    for word in WORDS:
+
+        async def command(self, message):
+            pass
+
+        command.security = security.OWNER | security.GROUP_MEMBER | security.PM
+        setattr(module, f"{word}cmd", command)
+
+    instance = module()
+    return {word: getattr(instance, f"{word}cmd") for word in WORDS}
+
+
+def build_watchers(count: int) -> typing.List[callable]:
+    """
+    Create watchers with the mix of tags, met in real modules
+    :param count: Number of watchers
+    :return: Bound watchers
+    """
+    tags = (
+        {},
+        {"no_commands": True},
+        {"only_messages": True, "in": True},
+        {"only_commands": True, "out": True},
+        {"only_media": True},
+        {"startswith": "hello"},
+    )
+
+    watchers = []
+    for i in range(count):
+
+        async def watcher(self, message):
+            pass
+
+        for tag, value in tags[i % len(tags)].items():
+            setattr(watcher, tag, value)
+
+        module = type(f"Module{i}", (), {"strings": {"name": f"Module{i}"}})
+        module.watcher = watcher
+        watchers.append(module().watcher)
+
+    return watchers
+
+
+def build_event(rnd: random.Random, client: StubClient):
+    """
+    Create new message event in group or private chat
+    :param rnd: Random generator
+    :param client: Client, message is bound to
+    :return: Event
+    """
+    from legacytl import events
+    from legacytl.tl.types import Message, PeerChat, PeerUser
+
+    sender = rnd.choice((ME, rnd.randint(1, 999)))
+    text = " ".join(rnd.choices(WORDS, k=5))
+    if rnd.random() < COMMANDS_SHARE:
+        text = f".{text}"
+
+    message = Message(
+        id=rnd.randint(1, 2**31),
+        peer_id=(
+            PeerChat(rnd.randint(1, 100)) if rnd.random() < 0.5 else PeerUser(sender)
+        ),
+        from_id=PeerUser(sender),
+        date=datetime.datetime.now(datetime.timezone.utc),
+        message=text,
+        out=sender == ME,
+    )
+    message._finish_init(client, {}, None)
+    return events.NewMessage.Event(message)
+
+
+def censored_context(event, settings: "DispatcherSettings") -> "EventContext":
+    """
+    Create context with censored copy of message, the way command path
+    used to get it
+    :param event: Event
+    :param settings: Dispatcher settings
+    :return: Context
+    """
+    from .. import utils
+    from ..dispatcher import EventContext
+
+    ctx = EventContext(event, settings)
+    ctx.message = utils.censor(ctx.message)
+    return ctx
+
+
+async def handle_incoming_separately(dispatcher: "CommandDispatcher", event):
+    """
+    Fan message out to watchers the way it was done, before the message was
+    shared with command path. Message is censored and its features are computed
+    here once again, and `only_commands` and `no_commands` watchers parse
+    command on their own
+    :param dispatcher: Dispatcher
+    :param event: Event
+    """
+    from legacytl.tl.types import Message
+
+    from .. import scheduler, utils
+    from ..dispatcher import EventFeatures
+
+    message = utils.censor(getattr(event, "message", event))
+
+    settings = dispatcher.settings
+    chat_id = utils.get_chat_id(message)
+    chat = str(chat_id)
+
+    if chat_id in settings.blacklist_chats or (
+        settings.whitelist_chats and chat_id not in settings.whitelist_chats
+    ):
+        return
+
+    features = EventFeatures(
+        event if isinstance(event, Message) else getattr(event, "message", event)
+    )
+    # Features used to be computed eagerly
+    features.mask
+
+    bl = settings.disabled_watchers
+    for func in dispatcher._modules.watchers:
+        modname = str(func.__self__.__class__.strings["name"])
+
+        if (
+            modname in bl
+            and isinstance(message, Message)
+            and (
+                ("*" in bl[modname])
+                or (chat_id in bl[modname])
+                or ("only_chats" in bl[modname] and message.is_private)
+                or ("only_pm" in bl[modname] and not message.is_private)
+            )
+            or dispatcher._module_blocked(settings, chat, func.__self__.__module__)
+            or await dispatcher._handle_tags(event, func, features)
+        ):
+            continue
+
+        for placeholder in {"text", "raw_text", "out"}:
+            try:
+                if not hasattr(message, placeholder):
+                    setattr(message, placeholder, "")
+            except UnicodeDecodeError:
+                pass
+
+        dispatcher.scheduler.submit(
+            scheduler.WATCHER,
+            func.__self__.__class__.__name__,
+            functools.partial(
+                dispatcher.future_dispatcher,
+                func,
+                message,
+                dispatcher.watcher_exc,
+                kind="watcher",
+            ),
+        )
+
+
+async def run_case(
+    watchers: int,
+    iterations: int,
+    base_path: Path,
+) -> typing.List[dict]:
+    """
+    Run both pipelines with given number of watchers
+    :param watchers: Number of watchers
+    :param iterations: Number of events for each pipeline
+    :param base_path: Directory to keep database in
+    :return: Scenario results
+    """
+    from ..database import Database
+    from ..dispatcher import CommandDispatcher
+    from ..storage import get_engine
+    from ..storage.benchmark import summarize
+
+    client = StubClient()
+    db = Database(client)
+    db._engine = get_engine("json", base_path, client.tg_id)
+    db._flush_interval = 3600
+    db.read()
+
+    dispatcher = CommandDispatcher(
+        StubModules(build_commands(), build_watchers(watchers)),
+        client,
+        db,
+    )
+
+    async def separate(event):
+        # Two independent handlers, the way `NewMessage` used to be registered.
+        # Each of them censors message on its own
+        await handle_incoming_separately(dispatcher, event)
+        if not event.message.fwd_from:
+            await dispatcher.handle_command(
+                event,
+                censored_context(event, dispatcher.settings),
+            )
+
+    scenarios = {
+        "separate": separate,
+        "shared": dispatcher.handle_new_message,
+    }
+
+    results = []
+    for scenario, handler in scenarios.items():
+        rnd = random.Random(0)
+        timings = []
+        for _ in range(iterations):
+            event = build_event(rnd, client)
+            start = time.perf_counter_ns()
+            await handler(event)
+            timings.append(time.perf_counter_ns() - start)
+
+            # Let scheduled watchers finish outside of measurement
+            while dispatcher.scheduler._tasks:
+                await asyncio.gather(*dispatcher.scheduler._tasks)
+
+        results.append(
+            {
+                "watchers": watchers,
+                "scenario": scenario,
+                **summarize(timings),
+            }
+        )
+
+    db.flush()
+    if db._saving_task:
+        db._saving_task.cancel()
+
+    db._engine.close()
+    return results
+
+
+async def run(watchers: typing.Iterable[int], iterations: int) -> dict:
+    results = []
+    for count in watchers:
+        with tempfile.TemporaryDirectory() as base_path:
+            results += await run_case(count, iterations, Path(base_path))
+            # Let cancelled flushers finish
+            await asyncio.sleep(0)
+
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "iterations": iterations,
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--watchers",
+        nargs="+",
+        type=int,
+        default=DEFAULT_WATCHERS,
+    )
+    parser.add_argument("--iterations", type=int, default=DEFAULT_ITERATIONS)
+    parser.add_argument("--output", type=Path, help="Write JSON results to file")
+    arguments = parser.parse_args()
+
+    # `main` parses command line on import
+    sys.argv = sys.argv[:1]
+    from .. import main as _  # noqa: F401
+
+    report = asyncio.run(run(arguments.watchers, arguments.iterations))
+
+    for result in report["results"]:
+        print(
+            "{watchers:>4} watchers {scenario:>9} p50 {p50_us:>9.1f}us"
+            " p99 {p99_us:>9.1f}us {ops_per_sec:>11.1f} events/s".format(**result),
+            file=sys.stderr,
+        )
+
+    if arguments.output:
+        arguments.output.write_text(json.dumps(report, indent=4))
+    else:
+        print(json.dumps(report, indent=4))
+
+
+if __name__ == "__main__":
+    main()
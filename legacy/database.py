@@ -6,16 +6,22 @@
 
 import asyncio
 import collections
-import ujson
+import contextlib
 import logging
+import threading
 import time
+import weakref
 
 import typing
+import ujson
 
 from legacytl.errors.rpcerrorlist import ChannelsTooMuchError
-from legacytl.tl.types import Message, User, ForumTopic
+from legacytl.extensions import BinaryReader
+from legacytl.tl.types import Channel, Chat, Message, User, ForumTopic
+from legacytl.utils import get_peer_id
 
-from . import main, utils
+from . import main, storage, utils
+from ._assets_cache import AssetsCache
 from .pointers import (
     BaseSerializingMiddlewareDict,
     BaseSerializingMiddlewareList,
@@ -39,6 +45,78 @@ __all__ = [
 
 logger = logging.getLogger(__name__)
 
+# Seconds to wait before dumping pending changes to disk.
+# Can be overriden with `db_flush_interval` key in `config.json`,
+# `0` disables write-behind and makes every save synchronous
+DEFAULT_FLUSH_INTERVAL = 1.0
+
+# Changes made within this number of seconds are grouped into a single revision
+REVISION_WINDOW = 3
+REVISIONS_LIMIT = 15
+# Telegram returns at most 100 messages per request
+ASSETS_BATCH = 100
+
+_databases: "weakref.WeakValueDictionary[int, Database]" = (
+    weakref.WeakValueDictionary()
+)
+
+
+def flush_all():
+    """Synchronously write pending changes of all databases to disk"""
+    for db in list(_databases.values()):
+        try:
+            db.flush()
+        except Exception:
+            logger.exception("Can't flush database")
+
+
+utils.atexit(flush_all)
+
+
+_PRIMITIVES = frozenset({str, int, float, bool, type(None)})
+
+
+def is_valid_value(value: typing.Any, /) -> bool:
+    """
+    Checks if value can be stored in database
+    Faster, than `utils.is_serializable`, because builtin types are checked
+    without serialization, which is used only for exotic ones
+    :param value: Value to check
+    :return: True if value is JSON-serializable, False otherwise
+    """
+    if type(value) in _PRIMITIVES:
+        return True
+
+    if type(value) in {list, tuple}:
+        return all(
+            type(item) in _PRIMITIVES or is_valid_value(item) for item in value
+        )
+
+    if type(value) is dict and all(type(key) in _PRIMITIVES for key in value):
+        return all(
+            type(item) in _PRIMITIVES or is_valid_value(item)
+            for item in value.values()
+        )
+
+    return utils.is_serializable(value)
+
+
+class _Missing:
+    """Marks the key, which didn't exist before revision"""
+
+
+_MISSING = _Missing()
+
+
+def _copy_value(value: JSONSerializable) -> JSONSerializable:
+    if value is None or isinstance(value, (str, int, float, _Missing)):
+        return value
+
+    try:
+        return ujson.loads(ujson.dumps(value))
+    except Exception:
+        return value
+
 
 class NoAssetsChannel(Exception):
     """Raised when trying to read/store asset with no asset channel present"""
@@ -49,18 +127,304 @@ class Database(dict):
         super().__init__()
         self._client: CustomTelegramClient = client
         self._next_revision_call: int = 0
-        self._revisions: typing.List[dict] = []
+        # Each revision maps owner to the keys, changed within revision,
+        # and their values before the first change
+        self._revisions: typing.Deque[
+            typing.Dict[str, typing.Dict[str, JSONSerializable]]
+        ] = collections.deque(maxlen=REVISIONS_LIMIT)
         self._assets_topic: typing.Optional[ForumTopic] = None
+        self._assets_cache: typing.Optional[AssetsCache] = None
         self._me: User = None
         self._saving_task: asyncio.Future = None
+        self._engine: typing.Optional[storage.StorageEngine] = None
+        self._dirty: bool = False
+        self._changes: typing.Optional[typing.Set[typing.Tuple[str, str]]] = set()
+        self._pending: typing.Deque[typing.Any] = collections.deque()
+        # Detached copies of mutable values, as they were when they were last
+        # read or written. Callers mutate values in place before `set`,
+        # so the stored value can't be used as the previous one
+        self._committed: typing.Dict[typing.Tuple[str, str], JSONSerializable] = {}
+        # Owners, which are present in storage, but weren't loaded by lazy engine
+        self._unloaded: typing.Set[str] = set()
+        # Stack of open transactions, each one keeps values of the keys
+        # before they were changed inside of it
+        self._transactions: typing.List[
+            typing.Dict[str, typing.Dict[str, JSONSerializable]]
+        ] = []
+        # Maps `(owner, key)` to callbacks, `None` key means any key of owner
+        self._subscribers: typing.Dict[
+            typing.Tuple[str, typing.Optional[str]],
+            typing.List[typing.Callable[[str, str], typing.Any]],
+        ] = {}
+        self._flush_interval: float = DEFAULT_FLUSH_INTERVAL
+        self._write_lock = threading.Lock()
+        _databases[id(self)] = self
 
     def __repr__(self):
         return object.__repr__(self)
 
+    def __missing__(self, owner: str) -> dict:
+        if owner not in self._unloaded:
+            raise KeyError(owner)
+
+        return self._load_owner(owner)
+
+    def __contains__(self, owner: str) -> bool:
+        return super().__contains__(owner) or owner in self._unloaded
+
+    # Views of the database include owners, which weren't loaded by lazy engine
+    # yet, so they are loaded first. Serializers, which read dict directly
+    # (e.g. `ujson.dumps`), still require `load_all` to be called beforehand
+
+    def __iter__(self) -> typing.Iterator[str]:
+        self.load_all()
+        return super().__iter__()
+
+    def __len__(self) -> int:
+        return super().__len__() + len(self._unloaded)
+
+    def keys(self) -> typing.KeysView[str]:
+        self.load_all()
+        return super().keys()
+
+    def values(self) -> typing.ValuesView[dict]:
+        self.load_all()
+        return super().values()
+
+    def items(self) -> typing.ItemsView[str, dict]:
+        self.load_all()
+        return super().items()
+
+    def _loaded(self) -> dict:
+        """Get owners, which are loaded already, without loading the rest"""
+        return dict(dict.items(self)) if self._unloaded else self
+
+    def _load_owner(self, owner: str) -> dict:
+        self._unloaded.discard(owner)
+        value = self._engine.load_owner(owner)
+        super().__setitem__(owner, value)
+        return value
+
+    def load_all(self):
+        """
+        Load owners, which were not accessed yet. Views of the database do it
+        on their own, but serializers, which read dict directly, don't
+        """
+        for owner in list(self._unloaded):
+            self._load_owner(owner)
+
+    def clear(self):
+        self.load_all()
+        for owner, values in self.items():
+            for key, value in values.items():
+                self._record_revision(owner, key, self._previous(owner, key))
+
+        changed = {owner: list(values) for owner, values in self.items()}
+        super().clear()
+        self._committed.clear()
+        self._notify(changed)
+
+    def update(self, *args, **kwargs):
+        values = dict(*args, **kwargs)
+        self._unloaded.difference_update(values)
+        super().update(values)
+        self._committed.clear()
+        self._notify(
+            {
+                owner: list(keys)
+                for owner, keys in values.items()
+                if isinstance(keys, dict)
+            }
+        )
+
+    def subscribe(
+        self,
+        owner: str,
+        key: typing.Optional[str],
+        callback: typing.Callable[[str, str], typing.Any],
+    ):
+        """
+        Call `callback(owner, key)` after the key is changed. Changes made
+        inside of transaction are reported once the outermost one succeeds
+        :param owner: Owner of the key
+        :param key: Key to watch or `None` to watch every key of owner
+        :param callback: Function to call. Exceptions raised by it are logged
+        """
+        self._subscribers.setdefault((owner, key), []).append(callback)
+
+    def unsubscribe(
+        self,
+        owner: str,
+        key: typing.Optional[str],
+        callback: typing.Callable[[str, str], typing.Any],
+    ):
+        """
+        Remove callback, added with `subscribe`
+        :param owner: Owner of the key
+        :param key: Key, passed to `subscribe`
+        :param callback: Function to remove
+        """
+        if callback in (callbacks := self._subscribers.get((owner, key), [])):
+            callbacks.remove(callback)
+
+        if not callbacks:
+            self._subscribers.pop((owner, key), None)
+
+    def _notify(self, changed: typing.Mapping[str, typing.Iterable[str]]):
+        if not self._subscribers:
+            return
+
+        for owner, keys in changed.items():
+            for key in keys:
+                for callback in (
+                    *self._subscribers.get((owner, key), ()),
+                    *self._subscribers.get((owner, None), ()),
+                ):
+                    try:
+                        callback(owner, key)
+                    except Exception:
+                        logger.exception("Database subscriber %s failed", callback)
+
+    def _snapshot(self, owner: str, key: str, value: JSONSerializable):
+        """Remember detached copy of value, which is stored under the key now"""
+        if value is None or isinstance(value, (str, int, float, _Missing)):
+            # Immutable values can't be changed behind `set`
+            self._committed.pop((owner, key), None)
+        else:
+            self._committed[(owner, key)] = _copy_value(value)
+
+    def _previous(self, owner: str, key: str) -> JSONSerializable:
+        """Get value of the key before it was mutated in place"""
+        if (owner, key) in self._committed:
+            return self._committed[(owner, key)]
+
+        return super().get(owner, {}).get(key, _MISSING)
+
+    def _record_revision(self, owner: str, key: str, value: JSONSerializable):
+        """Remember value of the key before its first change within revision"""
+        if self._next_revision_call < time.time() or not self._revisions:
+            self._revisions.append({})
+            self._next_revision_call = time.time() + REVISION_WINDOW
+
+        keys = self._revisions[-1].setdefault(owner, {})
+        if key not in keys:
+            keys[key] = _copy_value(value)
+
+    @contextlib.contextmanager
+    def transaction(self) -> typing.Iterator["Database"]:
+        """
+        Group several writes, so they are persisted with a single save at the
+        end of the block. If the block raises, keys changed inside of it are
+        reverted and the block leaves no revisions behind. Transactions can be
+        nested
+
+        Transaction is global to the database: every write made while it is
+        open joins it, no matter where it comes from. Therefore the block must
+        not `await`, otherwise writes of other coroutines get into it and
+        are reverted together with it
+
+        :example:
+            >>> with db.transaction():
+            ...     db.set("Module", "foo", 1)
+            ...     db.set("Module", "bar", 2)
+        """
+        self._transactions.append({})
+        base = self._revisions[-1] if self._revisions else None
+        recorded = {owner: set(keys) for owner, keys in (base or {}).items()}
+
+        try:
+            yield self
+        except BaseException:
+            self._undo(self._transactions.pop())
+            self._drop_revisions_since(base, recorded)
+            raise
+
+        changed = self._transactions.pop()
+
+        if self._transactions:
+            for owner, keys in changed.items():
+                parent = self._transactions[-1].setdefault(owner, {})
+                for key, value in keys.items():
+                    parent.setdefault(key, value)
+        elif changed:
+            self._request_flush()
+            self._notify(changed)
+
+    def _drop_revisions_since(
+        self,
+        base: typing.Optional[typing.Dict[str, typing.Dict[str, JSONSerializable]]],
+        recorded: typing.Dict[str, typing.Set[str]],
+    ):
+        """
+        Forget revisions, made after `base` one was the last
+        :param base: Last revision at that moment
+        :param recorded: Keys, which `base` revision held at that moment
+        """
+        while self._revisions and self._revisions[-1] is not base:
+            self._revisions.pop()
+
+        if not self._revisions:
+            return
+
+        for owner in list(base):
+            for key in set(base[owner]) - recorded.get(owner, set()):
+                del base[owner][key]
+
+            if not base[owner]:
+                del base[owner]
+
+    def _undo(self, revision: typing.Dict[str, typing.Dict[str, JSONSerializable]]):
+        for owner, keys in revision.items():
+            for key, value in keys.items():
+                if value is _MISSING:
+                    if owner in self:
+                        self[owner].pop(key, None)
+                else:
+                    super().setdefault(owner, {})[key] = value
+
+                self._snapshot(owner, key, value)
+
+                if self._changes is not None:
+                    self._changes.add((owner, key))
+
+    def rollback(self, n: int = 1) -> bool:
+        """
+        Revert last `n` revisions of the database
+        Revision contains all the changes, made within `REVISION_WINDOW` seconds
+        :param n: Number of revisions to revert
+        :return: `True` on success, `False` if there are not enough revisions
+        """
+        if n < 1 or n > len(self._revisions):
+            return False
+
+        changed = {}
+        for _ in range(n):
+            revision = self._revisions.pop()
+            self._undo(revision)
+            for owner, keys in revision.items():
+                changed.setdefault(owner, set()).update(keys)
+
+        self._request_flush()
+        self._notify(changed)
+        return True
+
     async def init(self):
         """Asynchronous initialization unit"""
-        self._db_file = main.BASE_PATH / f"config-{self._client.tg_id}.json"
+        self._engine = storage.get_engine(
+            main.get_config_key("db_engine") or storage.DEFAULT_ENGINE,
+            main.BASE_PATH,
+            self._client.tg_id,
+        )
+
+        if (interval := main.get_config_key("db_flush_interval")) is not False:
+            self._flush_interval = float(interval)
+
         self.read()
+        self._assets_cache = await utils.run_sync(
+            AssetsCache,
+            main.BASE_PATH,
+            self._client.tg_id,
+        )
 
         try:
             self._content_channel, _ = await utils.asset_channel(
@@ -96,12 +460,10 @@ class Database(dict):
 
     def read(self):
         """Read database and stores it in self"""
-        try:
-            self.update(**ujson.loads(self._db_file.read_text()))
-        except ValueError:
-            logger.warning("Database read failed! Creating new one...")
-        except FileNotFoundError:
-            logger.debug("Database file not found, creating new one...")
+        self.update(**self._engine.load())
+
+        if self._engine.lazy:
+            self._unloaded = set(self._engine.owners()) - set(dict.keys(self))
 
     def process_db_autofix(self, db: dict) -> bool:
         if not utils.is_serializable(db):
@@ -142,37 +504,130 @@ class Database(dict):
         return True
 
     def save(self) -> bool:
-        """Save database"""
-        if not self.process_db_autofix(self):
-            try:
-                rev = self._revisions.pop()
-                while not self.process_db_autofix(rev):
-                    rev = self._revisions.pop()
-            except IndexError:
+        """
+        Save the whole database
+        Changes are only marked as pending here and are written by background
+        flusher, which coalesces them into a single write. Use `flush` if you
+        need them on disk right away
+        """
+        self._changes = None
+        return self._request_flush()
+
+    def _request_flush(self) -> bool:
+        self._dirty = True
+
+        if self._flush_interval <= 0:
+            return self.flush()
+
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return self.flush()
+
+        if not self._saving_task or self._saving_task.done():
+            self._saving_task = asyncio.ensure_future(self._flusher())
+
+        return True
+
+    def flush(self) -> bool:
+        """Synchronously write pending changes to disk"""
+        if self._dirty:
+            self._pending.append(self._dump())
+
+        return self._write()
+
+    async def _flusher(self):
+        while self._dirty or self._pending:
+            await asyncio.sleep(self._flush_interval)
+
+            if self._dirty:
+                try:
+                    self._pending.append(self._dump())
+                except Exception:
+                    logger.exception("Database save failed!")
+                    break
+
+            await utils.run_sync(self._write)
+
+    def _dump(self) -> typing.Any:
+        """
+        Serialize pending changes. Must be called from the event loop,
+        because database can't be modified while being dumped
+        Values are validated once in `set`, so the database is not scanned here,
+        unless it was broken by in-place modification
+        :return: Payload of storage engine
+        """
+        try:
+            payload = self._engine.prepare(
+                self._loaded(),
+                self._changes,
+                frozenset(self._unloaded),
+            )
+        except Exception:
+            logger.exception("Database contains invalid data, restoring it")
+            self._restore()
+            payload = self._engine.prepare(
+                self._loaded(),
+                None,
+                frozenset(self._unloaded),
+            )
+
+        self._changes = set()
+        self._dirty = False
+        return payload
+
+    def _restore(self):
+        """
+        Drop values, broken by in-place modification, and undo revisions
+        only if database is still invalid after that
+        """
+        self._drop_unserializable()
+        while not self.process_db_autofix(self):
+            if not self._revisions:
                 raise RuntimeError(
                     "Can't find revision to restore broken database from "
                     "database is most likely broken and will lead to problems, "
                     "so its save is forbidden."
                 )
 
-            self.clear()
-            self.update(**rev)
+            self._undo(self._revisions.pop())
 
-            raise RuntimeError(
-                "Rewriting database to the last revision because new one destructed it"
-            )
+    def _drop_unserializable(self):
+        """Drop keys, which can't be serialized. They never get there through `set`"""
+        for owner, keys in list(dict.items(self)):
+            if not isinstance(keys, dict):
+                continue
+
+            for key, value in list(keys.items()):
+                if not utils.is_serializable(value):
+                    del keys[key]
+                    self._committed.pop((owner, key), None)
+                    logger.warning(
+                        "DbAutoFix: Dropped key %s of %s, because it is not"
+                        " serializable",
+                        key,
+                        owner,
+                    )
+                    if self._changes is not None:
+                        self._changes.add((owner, key))
 
-        if self._next_revision_call < time.time():
-            self._revisions += [dict(self)]
-            self._next_revision_call = time.time() + 3
+    def _write(self) -> bool:
+        """
+        Write pending payloads to disk in order they were dumped. Thread-safe,
+        payloads are kept in queue until they are written successfully
+        """
+        with self._write_lock:
+            if not (payloads := list(self._pending)):
+                return True
 
-        while len(self._revisions) > 15:
-            self._revisions.pop()
-        try:
-            self._db_file.write_text(ujson.dumps(self, indent=4))
-        except Exception:
-            logger.exception("Database save failed!")
-            return False
+            try:
+                self._engine.commit(payloads)
+            except Exception:
+                logger.exception("Database save failed!")
+                return False
+
+            for _ in payloads:
+                self._pending.popleft()
 
         return True
 
@@ -184,8 +639,8 @@ class Database(dict):
         if not self._assets_topic:
             raise NoAssetsChannel("Tried to save asset to non-existing asset topic")
 
-        return (
-            (await self._client.send_message(self._content_channel.id, message, reply_to=self._assets_topic.id)).id
+        asset = (
+            await self._client.send_message(self._content_channel.id, message, reply_to=self._assets_topic.id)
             if isinstance(message, Message)
             else (
                 await self._client.send_message(
@@ -194,19 +649,111 @@ class Database(dict):
                     force_document=True,
                     message_thread_id=self._assets_topic.id
                 )
-            ).id
+            )
+        )
+
+        await self._cache_asset(asset)
+        return asset.id
+
+    async def _cache_asset(self, asset: Message):
+        if self._assets_cache is None:
+            return
+
+        # Entities, message refers to, are kept along with it, so sender
+        # and chat of cached asset are the same as of the fetched one
+        entities = [
+            entity
+            for entity in (
+                asset._sender,
+                asset._chat,
+                getattr(asset, "_via_bot", None),
+                *(
+                    (asset.forward._sender, asset.forward._chat)
+                    if asset.forward
+                    else ()
+                ),
+            )
+            if isinstance(entity, (User, Chat, Channel))
+        ]
+        await utils.run_sync(
+            self._assets_cache.save,
+            self._content_channel.id,
+            asset.id,
+            b"".join(map(bytes, [asset, *entities])),
         )
 
+    async def _uncache_asset(self, asset_id: int):
+        if self._assets_cache is not None:
+            await utils.run_sync(
+                self._assets_cache.remove,
+                self._content_channel.id,
+                asset_id,
+            )
+
+    async def _read_cached_asset(self, asset_id: int) -> typing.Optional[Message]:
+        if self._assets_cache is None or not (
+            data := await utils.run_sync(
+                self._assets_cache.fetch,
+                self._content_channel.id,
+                asset_id,
+            )
+        ):
+            return None
+
+        try:
+            reader = BinaryReader(data)
+            asset = reader.tgread_object()
+            entities = {}
+            while reader.tell_position() < len(data):
+                entity = reader.tgread_object()
+                entities[get_peer_id(entity)] = entity
+
+            asset._finish_init(self._client, entities, None)
+        except Exception:
+            logger.debug("Cached asset %s is broken, dropping it", asset_id)
+            await self._uncache_asset(asset_id)
+            return None
+
+        return asset
+
     async def fetch_asset(self, asset_id: int) -> typing.Optional[Message]:
         """Fetch previously saved asset by its asset_id"""
+        return (await self.fetch_assets([asset_id]))[0]
+
+    async def fetch_assets(
+        self,
+        asset_ids: typing.List[int],
+    ) -> typing.List[typing.Optional[Message]]:
+        """
+        Fetch several previously saved assets
+        Assets are read from local cache if possible, the rest are requested
+        in batches of `ASSETS_BATCH`
+        :param asset_ids: IDs of assets
+        :return: Assets in the same order, `None` for ones which don't exist
+        """
         if not self._assets_topic:
             raise NoAssetsChannel(
                 "Tried to fetch asset from non-existing asset topic"
             )
 
-        asset = await self._client.get_messages(self._content_channel.id, ids=[asset_id])
-
-        return asset[0] if asset else None
+        assets = {}
+        missing = []
+        for asset_id in dict.fromkeys(asset_ids):
+            if (asset := await self._read_cached_asset(asset_id)) is not None:
+                assets[asset_id] = asset
+            else:
+                missing.append(asset_id)
+
+        for chunk in utils.chunks(missing, ASSETS_BATCH):
+            for asset_id, asset in zip(
+                chunk,
+                await self._client.get_messages(self._content_channel.id, ids=chunk),
+            ):
+                assets[asset_id] = asset
+                if asset is not None:
+                    await self._cache_asset(asset)
+
+        return [assets.get(asset_id) for asset_id in asset_ids]
 
     def get(
         self,
@@ -216,35 +763,64 @@ class Database(dict):
     ) -> JSONSerializable:
         """Get database key"""
         try:
-            return self[owner][key]
+            value = self[owner][key]
         except KeyError:
             return default
 
+        if not (
+            value is None
+            or isinstance(value, (str, int, float))
+            or (owner, key) in self._committed
+        ):
+            self._snapshot(owner, key, value)
+
+        return value
+
     def set(self, owner: str, key: str, value: JSONSerializable) -> bool:
         """Set database key"""
-        if not utils.is_serializable(owner):
+        if not is_valid_value(owner):
             raise RuntimeError(
                 "Attempted to write object to "
                 f"{owner=} ({type(owner)=}) of database. It is not "
                 "JSON-serializable key which will cause errors"
             )
 
-        if not utils.is_serializable(key):
+        if not is_valid_value(key):
             raise RuntimeError(
                 "Attempted to write object to "
                 f"{key=} ({type(key)=}) of database. It is not "
                 "JSON-serializable key which will cause errors"
             )
 
-        if not utils.is_serializable(value):
+        if not is_valid_value(value):
             raise RuntimeError(
                 "Attempted to write object of "
                 f"{key=} ({type(value)=}) to database. It is not "
                 "JSON-serializable value which will cause errors"
             )
 
-        super().setdefault(owner, {})[key] = value
-        return self.save()
+        if owner in self._unloaded:
+            self._load_owner(owner)
+
+        values = super().setdefault(owner, {})
+        old = self._previous(owner, key)
+        self._record_revision(owner, key, old)
+        values[key] = value
+        self._snapshot(owner, key, value)
+
+        if self._changes is not None:
+            self._changes.add((owner, key))
+
+        if self._transactions:
+            keys = self._transactions[-1].setdefault(owner, {})
+            if key not in keys:
+                keys[key] = _copy_value(old)
+
+            return True
+
+        result = self._request_flush()
+        self._notify({owner: (key,)})
+        return result
 
     def pointer(
         self,
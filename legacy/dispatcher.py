@@ -25,18 +25,23 @@
 import asyncio
 import contextlib
 import copy
+import functools
 import inspect
 import logging
+import operator
 import re
 import sys
+import time
 import traceback
 import typing
+import weakref
 
 from legacytl import events
 from legacytl.errors import FloodWaitError, RPCError
 from legacytl.tl.types import Message
 
-from . import main, security, utils
+from . import main, metrics, scheduler, security, utils
+from ._grep import Grep
 from .database import Database
 from .loader import Modules
 from .tl_cache import CustomTelegramClient
@@ -46,6 +51,7 @@ logger = logging.getLogger(__name__)
 # Keys for layout switch
 ru_keys = 'ёйцукенгшщзхъфывапролджэячсмитьбю.Ё"№;%:?ЙЦУКЕНГШЩЗХЪФЫВАПРОЛДЖЭ/ЯЧСМИТЬБЮ,'
 en_keys = "`qwertyuiop[]asdfghjkl;'zxcvbnm,./~@#$%^&QWERTYUIOP{}ASDFGHJKL:\"|ZXCVBNM<>?"
+LAYOUT_SWITCH = str.maketrans(ru_keys + en_keys, en_keys + ru_keys)
 ALL_TAGS = [
     "no_commands",
     "only_commands",
@@ -89,9 +95,400 @@ ALL_TAGS = [
     "thumb_url",
     "alias",
     "aliases",
+    "coalesce",
 ]
 
 
+def _freeze(items: typing.Iterable) -> typing.FrozenSet:
+    return frozenset(item for item in items if isinstance(item, typing.Hashable))
+
+
+def _split_chat_modules(
+    items: typing.Iterable,
+) -> typing.Tuple[typing.FrozenSet, typing.Dict[str, typing.FrozenSet[str]]]:
+    """
+    Split list, which mixes chat IDs and `"chat.module"` entries
+    :param items: List from database
+    :return: Chat IDs and mapping of stringified chat ID to module names
+    """
+    chats = set()
+    modules = {}
+    for item in items:
+        if isinstance(item, str) and "." in item:
+            chat, module = item.split(".", maxsplit=1)
+            modules.setdefault(chat, set()).add(module)
+        elif isinstance(item, typing.Hashable):
+            chats.add(item)
+
+    return frozenset(chats), {chat: frozenset(names) for chat, names in modules.items()}
+
+
+class DispatcherSettings(typing.NamedTuple):
+    """
+    Frozen copy of settings, which are checked for each event. Field names
+    match database keys. Lists are converted to frozensets and `"chat.module"`
+    entries are moved to `*_modules` mappings keyed by stringified chat ID
+    """
+
+    command_prefix: typing.Dict[str, str]
+    blacklist_chats: typing.FrozenSet
+    blacklist_modules: typing.Dict[str, typing.FrozenSet[str]]
+    whitelist_chats: typing.FrozenSet
+    whitelist_modules: typing.Dict[str, typing.FrozenSet[str]]
+    no_nickname: bool
+    nonickcmds: typing.FrozenSet[str]
+    nonickusers: typing.FrozenSet[int]
+    nonickchats: typing.FrozenSet[int]
+    grep: bool
+    disabled_watchers: typing.Dict[str, typing.FrozenSet]
+
+    @classmethod
+    def from_db(cls, db: Database) -> "DispatcherSettings":
+        get = functools.partial(db.get, main.__name__)
+        prefixes = get("command_prefix", {})
+        blacklist_chats, blacklist_modules = _split_chat_modules(
+            get("blacklist_chats", [])
+        )
+        _, whitelist_modules = _split_chat_modules(get("whitelist_modules", []))
+
+        return cls(
+            command_prefix=dict(prefixes) if isinstance(prefixes, dict) else {},
+            blacklist_chats=blacklist_chats,
+            blacklist_modules=blacklist_modules,
+            whitelist_chats=_freeze(get("whitelist_chats", [])),
+            whitelist_modules=whitelist_modules,
+            no_nickname=bool(get("no_nickname", False)),
+            nonickcmds=_freeze(get("nonickcmds", [])),
+            nonickusers=_freeze(get("nonickusers", [])),
+            nonickchats=_freeze(get("nonickchats", [])),
+            grep=bool(get("grep", False)),
+            disabled_watchers={
+                modname: _freeze(chats)
+                for modname, chats in get("disabled_watchers", {}).items()
+            },
+        )
+
+
+SETTINGS_KEYS = frozenset(DispatcherSettings._fields)
+
+
+# Features of event, which are checked by tags. `OUT` treats events without `out`
+# attribute as outgoing, `OUT_STRICT` treats them as incoming
+F_OUT = 1 << 0
+F_OUT_STRICT = 1 << 1
+F_MESSAGE = 1 << 2
+F_MEDIA = 1 << 3
+F_PHOTO = 1 << 4
+F_VIDEO = 1 << 5
+F_AUDIO = 1 << 6
+F_DOCUMENT = 1 << 7
+F_STICKER = 1 << 8
+F_INLINE = 1 << 9
+F_CHANNEL = 1 << 10
+F_BROADCAST = 1 << 11
+F_GROUP_STRICT = 1 << 12
+F_GROUP_LOOSE = 1 << 13
+F_PRIVATE = 1 << 14
+F_FORWARD = 1 << 15
+F_REPLY = 1 << 16
+F_MENTION = 1 << 17
+
+# Tag -> (features which must be present, features which must be absent)
+TAG_FEATURES = {
+    "out": (F_OUT, 0),
+    "in": (0, F_OUT),
+    "only_messages": (F_MESSAGE, 0),
+    "editable": (0, F_OUT_STRICT | F_FORWARD | F_STICKER | F_INLINE),
+    "no_media": (0, F_MEDIA),
+    "only_media": (F_MEDIA, 0),
+    "only_photos": (F_PHOTO, 0),
+    "only_videos": (F_VIDEO, 0),
+    "only_audios": (F_AUDIO, 0),
+    "only_stickers": (F_STICKER, 0),
+    "only_docs": (F_DOCUMENT, 0),
+    "only_inline": (F_INLINE, 0),
+    "only_channels": (F_BROADCAST, 0),
+    "no_channels": (0, F_CHANNEL),
+    "no_groups": (0, F_GROUP_STRICT),
+    "only_groups": (F_GROUP_LOOSE, 0),
+    "no_pm": (0, F_PRIVATE),
+    "only_pm": (F_PRIVATE, 0),
+    "no_inline": (0, F_INLINE),
+    "no_stickers": (0, F_STICKER),
+    "no_docs": (0, F_DOCUMENT),
+    "no_audios": (0, F_AUDIO),
+    "no_videos": (0, F_VIDEO),
+    "no_photos": (0, F_PHOTO),
+    "no_forwards": (0, F_FORWARD),
+    "no_reply": (0, F_REPLY),
+    "only_forwards": (F_FORWARD, 0),
+    "only_reply": (F_REPLY, 0),
+    "mention": (F_MENTION, 0),
+    "no_mention": (0, F_MENTION),
+}
+
+
+class EventFeatures:
+    """Properties of event, computed once and shared by all handlers"""
+
+    __slots__ = ("message", "command", "_mask", "_chat_id")
+
+    def __init__(self, message: typing.Any):
+        self.message = message
+        # Whether event is a userbot command. Computed on demand
+        self.command: typing.Optional[bool] = None
+        self._mask: typing.Optional[int] = None
+        self._chat_id = None
+
+    @property
+    def mask(self) -> int:
+        if self._mask is None:
+            self._mask = self._compute_mask(self.message)
+
+        return self._mask
+
+    @staticmethod
+    def _compute_mask(m: typing.Any) -> int:
+        is_message = isinstance(m, Message)
+        try:
+            mime = utils.mime_type(m)
+        except AttributeError:
+            # Media without document, e.g. photo
+            mime = ""
+
+        is_channel = getattr(m, "is_channel", False)
+        is_group = getattr(m, "is_group", False)
+        is_private = getattr(m, "is_private", False)
+
+        return (
+            (F_OUT if getattr(m, "out", True) else 0)
+            | (F_OUT_STRICT if getattr(m, "out", False) else 0)
+            | (F_MESSAGE if is_message else 0)
+            | (F_MEDIA if is_message and getattr(m, "media", False) else 0)
+            | (F_PHOTO if mime.startswith("image/") else 0)
+            | (F_VIDEO if mime.startswith("video/") else 0)
+            | (F_AUDIO if mime.startswith("audio/") else 0)
+            | (F_DOCUMENT if getattr(m, "document", False) else 0)
+            | (F_STICKER if getattr(m, "sticker", False) else 0)
+            | (F_INLINE if getattr(m, "via_bot_id", False) else 0)
+            | (F_CHANNEL if is_channel else 0)
+            | (F_BROADCAST if is_channel and not is_group else 0)
+            | (F_GROUP_STRICT if is_group and not is_private and not is_channel else 0)
+            | (F_GROUP_LOOSE if is_group or not is_private and not is_channel else 0)
+            | (F_PRIVATE if is_private else 0)
+            | (F_FORWARD if getattr(m, "fwd_from", False) else 0)
+            | (F_REPLY if getattr(m, "reply_to_msg_id", False) else 0)
+            | (F_MENTION if getattr(m, "mentioned", False) else 0)
+        )
+
+    @property
+    def chat_id(self) -> int:
+        if self._chat_id is None:
+            self._chat_id = utils.get_chat_id(self.message)
+
+        return self._chat_id
+
+
+class EventContext(EventFeatures):
+    """
+    Update, normalized once and consumed by both command dispatcher
+    and watchers. Everything is computed on first access. Message is not
+    censored here, sensitive fields are redacted when it's shown or logged
+    """
+
+    __slots__ = ("event", "settings", "_prefix", "_blocked")
+
+    def __init__(self, event: typing.Any, settings: DispatcherSettings):
+        super().__init__(
+            event if isinstance(event, Message) else getattr(event, "message", event)
+        )
+        self.event = event
+        self.settings = settings
+        self._prefix: typing.Optional[str] = None
+        self._blocked: typing.Optional[bool] = None
+
+    def prefix(self, tg_id: int) -> str:
+        """
+        Get command prefix of event sender
+        :param tg_id: ID of current account, whose prefix is used for own messages
+        :return: Prefix
+        """
+        if self._prefix is None:
+            prefixes = self.settings.command_prefix
+            default = prefixes.get(f"{tg_id}", ".") if self.event.out else "."
+            self._prefix = prefixes.get(f"{self.event.sender_id}", default)
+
+        return self._prefix
+
+    @property
+    def blocked(self) -> bool:
+        """Whether chat is blacklisted or not whitelisted"""
+        if self._blocked is None:
+            settings = self.settings
+            chat_id = self.chat_id
+            self._blocked = chat_id in settings.blacklist_chats or bool(
+                settings.whitelist_chats and chat_id not in settings.whitelist_chats
+            )
+
+        return self._blocked
+
+
+class FilterPlan(typing.NamedTuple):
+    """Tags of handler, compiled to feature masks and predicates"""
+
+    required: int
+    forbidden: int
+    # Tags, checked by masks, in the order of `ALL_TAGS`
+    tags: typing.Tuple[typing.Tuple[str, int, int], ...]
+    # `True` for `only_commands`, `False` for `no_commands`
+    commands: typing.Optional[bool]
+    predicates: typing.Tuple[
+        typing.Tuple[str, typing.Callable[[EventFeatures], typing.Any]], ...
+    ]
+    # Window in seconds, in which watcher events of the same chat are batched
+    coalesce: typing.Optional[float] = None
+
+    @classmethod
+    def of(cls, func: callable) -> "FilterPlan":
+        """
+        Get compiled plan of handler. Tags are compiled on first call
+        :param func: Command or watcher
+        :return: Compiled plan
+        """
+        key = getattr(func, "__func__", func)
+        try:
+            return _filter_plans[key]
+        except (KeyError, TypeError):
+            pass
+
+        plan = cls.compile(func)
+        with contextlib.suppress(TypeError):
+            _filter_plans[key] = plan
+
+        return plan
+
+    @classmethod
+    def compile(cls, func: callable) -> "FilterPlan":
+        tags = tuple(
+            (tag, *TAG_FEATURES[tag])
+            for tag in ALL_TAGS
+            if tag in TAG_FEATURES and getattr(func, tag, False)
+        )
+
+        predicates = []
+        if getattr(func, "startswith", False):
+            prefix = func.startswith
+            predicates.append(
+                (
+                    "startswith",
+                    lambda f: isinstance(f.message, Message)
+                    and f.message.raw_text.startswith(prefix),
+                )
+            )
+
+        if getattr(func, "endswith", False):
+            suffix = func.endswith
+            predicates.append(
+                (
+                    "endswith",
+                    lambda f: isinstance(f.message, Message)
+                    and f.message.raw_text.endswith(suffix),
+                )
+            )
+
+        if getattr(func, "contains", False):
+            substring = func.contains
+            predicates.append(
+                (
+                    "contains",
+                    lambda f: isinstance(f.message, Message)
+                    and substring in f.message.raw_text,
+                )
+            )
+
+        if getattr(func, "regex", False):
+            regex = re.compile(func.regex)
+            predicates.append(
+                (
+                    "regex",
+                    lambda f: isinstance(f.message, Message)
+                    and regex.search(f.message.raw_text),
+                )
+            )
+
+        if getattr(func, "filter", False):
+            # Predicates must not reference the handler, otherwise its plan,
+            # which is weakly keyed by it, is never collected
+            flt = func.filter
+            predicates.append(
+                (
+                    "filter",
+                    (lambda f: flt(f.message)) if callable(flt) else (lambda f: False),
+                )
+            )
+
+        if getattr(func, "from_id", False):
+            from_id = func.from_id
+            predicates.append(
+                (
+                    "from_id",
+                    lambda f: getattr(f.message, "sender_id", None) == from_id,
+                )
+            )
+
+        if getattr(func, "chat_id", False):
+            chat_id = (
+                func.chat_id
+                if not str(func.chat_id).startswith("-100")
+                else int(str(func.chat_id)[4:])
+            )
+            predicates.append(("chat_id", lambda f: f.chat_id == chat_id))
+
+        return cls(
+            required=functools.reduce(operator.or_, (tag[1] for tag in tags), 0),
+            forbidden=functools.reduce(operator.or_, (tag[2] for tag in tags), 0),
+            tags=tags,
+            commands=(
+                False
+                if getattr(func, "no_commands", False)
+                else True if getattr(func, "only_commands", False) else None
+            ),
+            predicates=tuple(predicates),
+            coalesce=float(getattr(func, "coalesce", 0) or 0) or None,
+        )
+
+    def failed_tag(self, mask: int) -> typing.Optional[str]:
+        return next(
+            (
+                tag
+                for tag, required, forbidden in self.tags
+                if (mask & required) != required or mask & forbidden
+            ),
+            None,
+        )
+
+
+# Compiled plans by underlying function, so they are dropped with unloaded modules
+_filter_plans: "weakref.WeakKeyDictionary[typing.Callable, FilterPlan]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def grep_text(grep: Grep, text: str) -> str:
+    """
+    Filter command output with grep
+    :param grep: Compiled grep
+    :param text: Command output
+    :return: Filtered output or placeholder, if nothing is left
+    """
+    if not (grepped := grep(text)).strip():
+        return (
+            "<emoji document_id=5237808360882977239>✂️</emoji> <b>No lines to grep</b>"
+        )
+
+    return grepped
+
+
 class CommandDispatcher:
     def __init__(
         self,
@@ -105,8 +502,11 @@ class CommandDispatcher:
         self._db = db
 
         self.security = security.SecurityManager(client, db)
+        self.scheduler = scheduler.Scheduler()
+        self.metrics = metrics.Metrics()
 
         self.check_security = self.security.check
+        self.check_security_many = self.security.check_many
         self._me = self._client.legacy_me.id
         self._cached_usernames = [
             (
@@ -121,31 +521,45 @@ class CommandDispatcher:
         )
 
         self.raw_handlers = []
+        # (watcher, chat ID) -> messages, waiting for the end of coalescing window
+        self._bursts: typing.Dict[tuple, typing.List[Message]] = {}
+        # Update class -> handlers, subscribed to it. Filled on first update
+        # of each class and reset when handlers change
+        self._raw_index: typing.Dict[type, typing.Tuple[callable, ...]] = {}
+        # Prefix -> same prefix, typed with switched keyboard layout
+        self._switched_prefixes: typing.Dict[str, str] = {}
+
+        self._migrate_prefix()
+        self._settings: typing.Optional[DispatcherSettings] = None
+        self._db.subscribe(main.__name__, None, self._on_settings_change)
+
+    def _migrate_prefix(self):
+        """Convert legacy string prefix to the per-user mapping"""
+        prefix = self._db.get(main.__name__, "command_prefix", None)
+        if prefix and isinstance(prefix, str):
+            self._db.set(
+                main.__name__,
+                "command_prefix",
+                {f"{self.client.tg_id}": prefix},
+            )
 
-    def _grep(
-        self, pattern: str, text: str, invert: bool = False, ignore_case: bool = False
-    ) -> str:
-        regex = re.compile(
-            re.escape(pattern).strip(), (re.IGNORECASE if ignore_case else 0)
-        )
-        result = []
+    def _on_settings_change(self, _: str, key: str):
+        if key in SETTINGS_KEYS:
+            self._settings = None
 
-        for line in text.splitlines():
-            match = regex.search(utils.remove_html(line).strip())
-            isMatched = bool(match)
+    @property
+    def settings(self) -> DispatcherSettings:
+        """Current dispatcher settings. Rebuilt lazily after they change"""
+        if self._settings is None:
+            self._settings = DispatcherSettings.from_db(self._db)
 
-            if invert:
-                isMatched = not isMatched
+        return self._settings
 
-            if isMatched:
-                if match:
-                    highlight = lambda m: f"<u><i>{m.group(0)}</i></u>"
-                    highlighted_line = line.replace(match.group(0), highlight(match))
-                    result.append(highlighted_line)
-                else:
-                    result.append(line)
+    def _switch_prefix(self, prefix: str) -> str:
+        if (switched := self._switched_prefixes.get(prefix)) is None:
+            switched = self._switched_prefixes[prefix] = prefix.translate(LAYOUT_SWITCH)
 
-        return "\n".join(result)
+        return switched
 
     def _handle_grep(self, message: Message) -> Message:
         # Allow escaping grep with double stick
@@ -161,7 +575,7 @@ class CommandDispatcher:
         if not re.search(r".+\| ?grep (.+)", message.raw_text):
             return message
 
-        grep_raw_args = re.search(r".+\| ?grep (.+)", message.raw_text).group(1)
+        grep = Grep.parse(re.search(r".+\| ?grep (.+)", message.raw_text).group(1))
 
         message.text = re.sub(r"\| ?grep.+", "", message.text)
         message.raw_text = re.sub(r"\| ?grep.+", "", message.raw_text)
@@ -171,37 +585,24 @@ class CommandDispatcher:
         old_reply = message.reply
         old_respond = message.respond
 
-        def process_text(text: str) -> str:
-            grep_args = grep_raw_args.split(" ")
-
-            ignore_case = "-i" in grep_args
-            invert = "-v" in grep_args
+        def process_text(text: str, kwargs: dict) -> str:
+            # `utils.answer` filters text itself before splitting it
+            if kwargs.pop("grepped", False):
+                return text
 
-            filtered_pattern = [str(a) for a in grep_args if a not in ("-i", "-v")]
-            pattern = " ".join(filtered_pattern) if filtered_pattern else ".*"
-
-            grepped_text = self._grep(
-                pattern=pattern, text=text, invert=invert, ignore_case=ignore_case
-            )
-
-            if not grepped_text.strip():
-                return "<emoji document_id=5237808360882977239>✂️</emoji> <b>No lines to grep</b>"
-
-            return grepped_text
+            kwargs["parse_mode"] = "HTML"
+            return grep_text(grep, text)
 
         async def my_edit(text, *args, **kwargs):
-            text = process_text(text)
-            kwargs["parse_mode"] = "HTML"
+            text = process_text(text, kwargs)
             return await old_edit(text, *args, **kwargs)
 
         async def my_reply(text, *args, **kwargs):
-            text = process_text(text)
-            kwargs["parse_mode"] = "HTML"
+            text = process_text(text, kwargs)
             return await old_reply(text, *args, **kwargs)
 
         async def my_respond(text, *args, **kwargs):
-            text = process_text(text)
-            kwargs["parse_mode"] = "HTML"
+            text = process_text(text, kwargs)
             kwargs.setdefault("reply_to", utils.get_topic(message))
             return await old_respond(text, *args, **kwargs)
 
@@ -209,6 +610,7 @@ class CommandDispatcher:
         message.reply = my_reply
         message.respond = my_respond
         message.legacy_grepped = True
+        message.legacy_grep = functools.partial(grep_text, grep)
 
         return message
 
@@ -216,27 +618,19 @@ class CommandDispatcher:
         self,
         event: typing.Union[events.NewMessage, events.MessageDeleted],
         watcher: bool = False,
+        ctx: typing.Optional[EventContext] = None,
     ) -> typing.Union[bool, typing.Tuple[Message, str, str, callable]]:
         if not hasattr(event, "message") or not hasattr(event.message, "message"):
             return False
 
-        key = main.__name__
-        default = "."
-        prefix = self._db.get(key, "command_prefix", default)
-        if prefix:
-            if isinstance(prefix, str):
-                self._db.set(key, "command_prefix", {f"{self.client.tg_id}": prefix})
-        set_default_prefix = (
-            self._db.get(key, "command_prefix").get(f"{self.client.tg_id}")
-            if event.out
-            else default
-        )
-        prefix = self._db.get(key, "command_prefix", {}).get(
-            f"{event.sender_id}", set_default_prefix
-        )
+        if ctx is None:
+            ctx = EventContext(event, self.settings)
 
-        change = str.maketrans(ru_keys + en_keys, en_keys + ru_keys)
-        message = utils.censor(event.message)
+        settings = ctx.settings
+        prefix = ctx.prefix(self.client.tg_id)
+
+        switched_prefix = self._switch_prefix(prefix)
+        message = ctx.message
 
         if not event.message.message:
             return False
@@ -247,8 +641,8 @@ class CommandDispatcher:
             and (
                 message.message.startswith(prefix * 2)
                 and any(s != prefix for s in message.message)
-                or message.message.startswith(str.translate(prefix * 2, change))
-                and any(s != str.translate(prefix, change) for s in message.message)
+                or message.message.startswith(switched_prefix * 2)
+                and any(s != switched_prefix for s in message.message)
             )
             and prefix != "s"  # To avoid bug with setprefix command
         ):
@@ -265,23 +659,18 @@ class CommandDispatcher:
             return False
 
         if (
-            event.message.message.startswith(str.translate(prefix, change))
-            and str.translate(prefix, change) != prefix
+            event.message.message.startswith(switched_prefix)
+            and switched_prefix != prefix
         ):
-            message.text = str.translate(message.text, change)
+            message.text = message.text.translate(LAYOUT_SWITCH)
         elif not event.message.message.startswith(prefix):
             return False
 
-        blacklist_chats = self._db.get(main.__name__, "blacklist_chats", [])
-        whitelist_chats = self._db.get(main.__name__, "whitelist_chats", [])
-        whitelist_modules = self._db.get(main.__name__, "whitelist_modules", [])
-        chat_id = utils.get_chat_id(message)
-
-        if chat_id in blacklist_chats or (
-            whitelist_chats and chat_id not in whitelist_chats
-        ):
+        if ctx.blocked:
             return False
 
+        chat_id = ctx.chat_id
+
         if not message.message or len(message.message) == len(prefix):
             return False  # Message is just the prefix
 
@@ -312,67 +701,140 @@ class CommandDispatcher:
             pass
         elif (
             not event.is_private
-            and not self._db.get(main.__name__, "no_nickname", False)
-            and command not in self._db.get(main.__name__, "nonickcmds", [])
-            and initiator not in self._db.get(main.__name__, "nonickusers", [])
+            and not settings.no_nickname
+            and command not in settings.nonickcmds
+            and initiator not in settings.nonickusers
             and not self.security.check_tsec(initiator, command)
-            and utils.get_chat_id(event)
-            not in self._db.get(main.__name__, "nonickchats", [])
+            and chat_id not in settings.nonickchats
         ):
             return False
 
         txt, func = self._modules.dispatch(tag[0])
 
-        if not func or not await self.security.check(
+        if not func:
+            return False
+
+        stats = self.metrics.of(func, "command") if self.metrics.enabled else None
+        if stats is not None:
+            start = time.perf_counter_ns()
+
+        allowed = await self.security.check(
             message,
             func,
             usernames=self._cached_usernames,
-        ):
+        )
+
+        if stats is not None:
+            stats.security += time.perf_counter_ns() - start
+
+        if not allowed:
             return False
 
         message.message = prefix + txt + message.message[len(prefix + command) :]
 
-        if (
-            f"{str(chat_id)}.{func.__self__.__module__}" in blacklist_chats
-            or whitelist_modules
-            and f"{chat_id}.{func.__self__.__module__}" not in whitelist_modules
-        ):
+        if self._module_blocked(settings, str(chat_id), func.__self__.__module__):
             return False
 
-        if await self._handle_tags(event, func):
+        if stats is not None:
+            start = time.perf_counter_ns()
+
+        failed = await self._handle_tags(event, func, ctx)
+
+        if stats is not None:
+            stats.tags += time.perf_counter_ns() - start
+
+        if failed:
             return False
 
-        if self._db.get(main.__name__, "grep", False) and not watcher:
+        if settings.grep and not watcher:
             message = self._handle_grep(message)
 
         return message, prefix, txt, func
 
+    @staticmethod
+    def _module_blocked(settings: DispatcherSettings, chat: str, module: str) -> bool:
+        return module in settings.blacklist_modules.get(chat, ()) or bool(
+            settings.whitelist_modules
+            and module not in settings.whitelist_modules.get(chat, ())
+        )
+
+    def add_raw_handler(self, handler: callable):
+        """
+        Register raw handler
+        :param handler: Method, marked with `loader.raw_handler`
+        """
+        self.raw_handlers.append(handler)
+        self._raw_index.clear()
+
+    def remove_raw_handler(self, handler: callable):
+        """
+        Unregister raw handler
+        :param handler: Previously registered handler
+        """
+        self.raw_handlers.remove(handler)
+        self._raw_index.clear()
+
+    def _raw_handlers_for(self, update: type) -> typing.Tuple[callable, ...]:
+        if (handlers := self._raw_index.get(update)) is None:
+            handlers = self._raw_index[update] = tuple(
+                handler
+                for handler in self.raw_handlers
+                if issubclass(update, tuple(handler.updates))
+            )
+
+        return handlers
+
     async def handle_raw(self, event: events.Raw):
         """Handle raw events."""
-        for handler in self.raw_handlers:
-            if isinstance(event, tuple(handler.updates)):
-                try:
-                    await handler(event)
-                except Exception as e:
-                    logger.exception("Error in raw handler %s: %s", handler.id, e)
+        for handler in self._raw_handlers_for(type(event)):
+            try:
+                await handler(event)
+            except Exception as e:
+                logger.exception("Error in raw handler %s: %s", handler.id, e)
+
+    async def handle_new_message(self, event: events.NewMessage):
+        """
+        Handle new message. It's parsed once and then passed to
+        command dispatcher and to watchers
+        """
+        ctx = EventContext(event, self.settings)
+
+        if not event.message.fwd_from:
+            try:
+                await self.handle_command(event, ctx)
+            except Exception:
+                logger.exception("Unable to handle command")
+
+        await self.handle_incoming(event, ctx)
 
     async def handle_command(
         self,
         event: typing.Union[events.NewMessage, events.MessageDeleted],
+        ctx: typing.Optional[EventContext] = None,
     ):
         """Handle all commands"""
-        message = await self._handle_command(event)
+        if ctx is None:
+            ctx = EventContext(event, self.settings)
+
+        message = await self._handle_command(event, ctx=ctx)
+        # Watchers with `only_commands` and `no_commands` tags reuse the result
+        ctx.command = bool(message)
         if not message:
             return
 
         message, _, _, func = message
 
-        asyncio.ensure_future(
-            self.future_dispatcher(
+        # Owner's own commands are never queued behind incoming work
+        self.scheduler.submit(
+            scheduler.OWNER_COMMAND if message.out else scheduler.COMMAND,
+            func.__self__.__class__.__name__,
+            functools.partial(
+                self.future_dispatcher,
                 func,
                 message,
                 self.command_exc,
-            )
+                queued_at=time.perf_counter_ns() if self.metrics.enabled else 0,
+            ),
         )
 
     async def command_exc(self, _, message: Message):
@@ -438,133 +900,89 @@ class CommandDispatcher:
         self,
         event: typing.Union[events.NewMessage, events.MessageDeleted],
         func: callable,
+        features: typing.Optional["EventFeatures"] = None,
+    ) -> bool:
+        return bool(await self._handle_tags_ext(event, func, features))
+
+    async def _handle_tags_timed(
+        self,
+        event: typing.Union[events.NewMessage, events.MessageDeleted],
+        func: callable,
+        features: EventFeatures,
     ) -> bool:
-        return bool(await self._handle_tags_ext(event, func))
+        """Same as `_handle_tags`, but the time is added to watcher statistics"""
+        start = time.perf_counter_ns()
+        try:
+            return await self._handle_tags(event, func, features)
+        finally:
+            self.metrics.of(func, "watcher").tags += time.perf_counter_ns() - start
 
     async def _handle_tags_ext(
         self,
         event: typing.Union[events.NewMessage, events.MessageDeleted],
         func: callable,
+        features: typing.Optional["EventFeatures"] = None,
     ) -> typing.Optional[str]:
         """
         Handle tags.
         :param event: The event to handle.
         :param func: The function to handle.
+        :param features: Features of the event, if they were already computed.
+            Command detection result is saved there, so it's done once per event.
         :return: The reason for the tag to fail.
         """
-        m = event if isinstance(event, Message) else getattr(event, "message", event)
-
-        reverse_mapping = {
-            "out": lambda: getattr(m, "out", True),
-            "in": lambda: not getattr(m, "out", True),
-            "only_messages": lambda: isinstance(m, Message),
-            "editable": (
-                lambda: not getattr(m, "out", False)
-                and not getattr(m, "fwd_from", False)
-                and not getattr(m, "sticker", False)
-                and not getattr(m, "via_bot_id", False)
-            ),
-            "no_media": lambda: (
-                not isinstance(m, Message) or not getattr(m, "media", False)
-            ),
-            "only_media": lambda: isinstance(m, Message) and getattr(m, "media", False),
-            "only_photos": lambda: utils.mime_type(m).startswith("image/"),
-            "only_videos": lambda: utils.mime_type(m).startswith("video/"),
-            "only_audios": lambda: utils.mime_type(m).startswith("audio/"),
-            "only_stickers": lambda: getattr(m, "sticker", False),
-            "only_docs": lambda: getattr(m, "document", False),
-            "only_inline": lambda: getattr(m, "via_bot_id", False),
-            "only_channels": lambda: (
-                getattr(m, "is_channel", False) and not getattr(m, "is_group", False)
-            ),
-            "no_channels": lambda: not getattr(m, "is_channel", False),
-            "no_groups": (
-                lambda: not getattr(m, "is_group", False)
-                or getattr(m, "is_private", False)
-                or getattr(m, "is_channel", False)
-            ),
-            "only_groups": (
-                lambda: getattr(m, "is_group", False)
-                or not getattr(m, "is_private", False)
-                and not getattr(m, "is_channel", False)
-            ),
-            "no_pm": lambda: not getattr(m, "is_private", False),
-            "only_pm": lambda: getattr(m, "is_private", False),
-            "no_inline": lambda: not getattr(m, "via_bot_id", False),
-            "no_stickers": lambda: not getattr(m, "sticker", False),
-            "no_docs": lambda: not getattr(m, "document", False),
-            "no_audios": lambda: not utils.mime_type(m).startswith("audio/"),
-            "no_videos": lambda: not utils.mime_type(m).startswith("video/"),
-            "no_photos": lambda: not utils.mime_type(m).startswith("image/"),
-            "no_forwards": lambda: not getattr(m, "fwd_from", False),
-            "no_reply": lambda: not getattr(m, "reply_to_msg_id", False),
-            "only_forwards": lambda: getattr(m, "fwd_from", False),
-            "only_reply": lambda: getattr(m, "reply_to_msg_id", False),
-            "mention": lambda: getattr(m, "mentioned", False),
-            "no_mention": lambda: not getattr(m, "mentioned", False),
-            "startswith": lambda: (
-                isinstance(m, Message) and m.raw_text.startswith(func.startswith)
-            ),
-            "endswith": lambda: (
-                isinstance(m, Message) and m.raw_text.endswith(func.endswith)
-            ),
-            "contains": lambda: isinstance(m, Message) and func.contains in m.raw_text,
-            "filter": lambda: callable(func.filter) and func.filter(m),
-            "from_id": lambda: getattr(m, "sender_id", None) == func.from_id,
-            "chat_id": (
-                lambda: utils.get_chat_id(m)
-                == (
-                    func.chat_id
-                    if not str(func.chat_id).startswith("-100")
-                    else int(str(func.chat_id)[4:])
-                )
-            ),
-            "regex": lambda: (
-                isinstance(m, Message) and re.search(func.regex, m.raw_text)
-            ),
-        }
+        plan = FilterPlan.of(func)
 
-        return (
-            "no_commands"
-            if getattr(func, "no_commands", False)
-            and await self._handle_command(event, watcher=True)
-            else (
-                "only_commands"
-                if getattr(func, "only_commands", False)
-                and not await self._handle_command(event, watcher=True)
-                else next(
-                    (
-                        tag
-                        for tag in ALL_TAGS
-                        if getattr(func, tag, False)
-                        and tag in reverse_mapping
-                        and not reverse_mapping[tag]()
-                    ),
-                    None,
-                )
+        if features is None:
+            features = EventFeatures(
+                event
+                if isinstance(event, Message)
+                else getattr(event, "message", event)
             )
+
+        mask = features.mask
+        if (mask & plan.required) != plan.required or (mask & plan.forbidden):
+            return plan.failed_tag(mask)
+
+        if plan.commands is not None:
+            if features.command is None:
+                features.command = bool(
+                    await self._handle_command(
+                        event,
+                        watcher=True,
+                        ctx=features if isinstance(features, EventContext) else None,
+                    )
+                )
+
+            if features.command != plan.commands:
+                return "only_commands" if plan.commands else "no_commands"
+
+        return next(
+            (tag for tag, predicate in plan.predicates if not predicate(features)),
+            None,
         )
 
     async def handle_incoming(
         self,
         event: typing.Union[events.NewMessage, events.MessageDeleted],
+        ctx: typing.Optional[EventContext] = None,
     ):
         """Handle all incoming messages"""
-        message = utils.censor(getattr(event, "message", event))
-
-        blacklist_chats = self._db.get(main.__name__, "blacklist_chats", [])
-        whitelist_chats = self._db.get(main.__name__, "whitelist_chats", [])
-        whitelist_modules = self._db.get(main.__name__, "whitelist_modules", [])
-        chat_id = utils.get_chat_id(message)
+        if ctx is None:
+            ctx = EventContext(event, self.settings)
 
-        if (blacklist_chats and chat_id in blacklist_chats) or (
-            whitelist_chats and chat_id not in whitelist_chats
-        ):
+        if ctx.blocked:
             logger.debug("Message is blacklisted")
             return
 
+        message = ctx.message
+        settings = ctx.settings
+        chat_id = ctx.chat_id
+        chat = str(chat_id)
+
+        bl = settings.disabled_watchers
+        timed = self.metrics.enabled
         for func in self._modules.watchers:
-            bl = self._db.get(main.__name__, "disabled_watchers", {})
             modname = str(func.__self__.__class__.strings["name"])
 
             if (
@@ -576,11 +994,12 @@ class CommandDispatcher:
                     or ("only_chats" in bl[modname] and message.is_private)
                     or ("only_pm" in bl[modname] and not message.is_private)
                 )
-                or f"{str(chat_id)}.{func.__self__.__module__}" in blacklist_chats
-                or whitelist_modules
-                and f"{str(chat_id)}.{func.__self__.__module__}"
-                not in whitelist_modules
-                or await self._handle_tags(event, func)
+                or self._module_blocked(settings, chat, func.__self__.__module__)
+                or (
+                    await self._handle_tags_timed(event, func, ctx)
+                    if timed
+                    else await self._handle_tags(event, func, ctx)
+                )
             ):
                 continue
 
@@ -593,27 +1012,85 @@ class CommandDispatcher:
                 except UnicodeDecodeError:
                     pass
 
-            # Run watcher via ensure_future so in case user has a lot
-            # of watchers with long actions, they can run simultaneously
-            asyncio.ensure_future(
-                self.future_dispatcher(
+            if window := FilterPlan.of(func).coalesce:
+                self._coalesce(func, chat_id, message, window)
+                continue
+
+            # Watchers run simultaneously, but flood of events can't spawn
+            # more of them than scheduler allows
+            self.scheduler.submit(
+                scheduler.WATCHER,
+                func.__self__.__class__.__name__,
+                functools.partial(
+                    self.future_dispatcher,
                     func,
                     message,
                     self.watcher_exc,
-                )
+                    queued_at=time.perf_counter_ns() if timed else 0,
+                    kind="watcher",
+                ),
             )
 
+    def _coalesce(self, func: callable, chat_id: int, message: Message, window: float):
+        """
+        Add message to the burst of watcher in chat. The first message of burst
+        starts the window, after which watcher is called once with all of them
+        """
+        key = (func, chat_id)
+        if (burst := self._bursts.get(key)) is not None:
+            burst.append(message)
+            return
+
+        self._bursts[key] = [message]
+        asyncio.get_running_loop().call_later(window, self._flush_burst, key)
+
+    def _flush_burst(self, key: typing.Tuple[callable, int]):
+        func, _ = key
+        messages = self._bursts.pop(key)
+        if func not in self._modules.watchers:
+            # Module was unloaded during the window
+            return
+
+        self.scheduler.submit(
+            scheduler.WATCHER,
+            func.__self__.__class__.__name__,
+            functools.partial(
+                self.future_dispatcher,
+                func,
+                messages,
+                self.watcher_exc,
+                queued_at=time.perf_counter_ns() if self.metrics.enabled else 0,
+                kind="watcher",
+            ),
+        )
+
     async def future_dispatcher(
         self,
         func: callable,
-        message: Message,
+        message: typing.Union[Message, typing.List[Message]],
         exception_handler: callable,
         *args,
+        queued_at: int = 0,
+        kind: str = "command",
     ):
         # Will be used to determine, which client caused logging messages
         # parsed via inspect.stack()
         _legacy_client_id_logging_tag = copy.copy(self.client.tg_id)  # noqa: F841
+        stats = None
+        if self.metrics.enabled:
+            stats = self.metrics.of(func, kind)
+            start = time.perf_counter_ns()
+            if queued_at:
+                stats.queue.add(start - queued_at)
+
         try:
             await func(message)
         except Exception as e:
+            if stats is not None:
+                stats.errors += 1
+                stats.handler.add(time.perf_counter_ns() - start)
+
             await exception_handler(e, message, *args)
+        else:
+            if stats is not None:
+                stats.handler.add(time.perf_counter_ns() - start)
@@ -401,11 +401,13 @@ class Events(InlineUnit):
 
     async def _query_help(self, inline_query: InlineQuery):
         _help = []
-        for name, fun in self._allmodules.inline_handlers.items():
-            if not await self.check_inline_security(
-                func=fun,
-                user=inline_query.from_user.id,
-            ):
+        handlers = list(self._allmodules.inline_handlers.items())
+        allowed = await self.check_inline_security_many(
+            funcs=[fun for _, fun in handlers],
+            user=inline_query.from_user.id,
+        )
+        for (name, fun), permitted in zip(handlers, allowed):
+            if not permitted:
                 continue
 
             try:
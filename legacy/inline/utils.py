@@ -259,6 +259,27 @@ class Utils(InlineUnit):
             inline_cmd=self._reverse_method_lookup(func),
         )
 
+    async def check_inline_security_many(
+        self,
+        *,
+        funcs: typing.Sequence[typing.Callable],
+        user: int,
+    ) -> typing.List[bool]:
+        """Checks if user with id `user` is allowed to run each of `funcs`"""
+        names = {}
+        for name, method in itertools.chain(
+            self._allmodules.inline_handlers.items(),
+            self._allmodules.callback_handlers.items(),
+        ):
+            names.setdefault(method, name)
+
+        return await self._client.dispatcher.security.check_many(
+            message=None,
+            funcs=funcs,
+            user_id=user,
+            inline_cmds=[names.get(func) for func in funcs],
+        )
+
     def _find_caller_sec_map(self) -> typing.Optional[typing.Callable[[], int]]:
         try:
             caller = utils.find_caller()
@@ -14,6 +14,7 @@ import importlib
 import importlib.machinery
 import importlib.util
 import inspect
+import itertools
 import logging
 import os
 import re
@@ -458,6 +459,8 @@ def inline_handler(*args, **kwargs):
 def watcher(*args, **kwargs):
     """
     Decorator that marks function as watcher
+    Pass `coalesce=<seconds>` to get list of messages, received in the same chat
+    within this window, instead of single message
     """
     return _mark_method("is_watcher", *args, **kwargs)
 
@@ -502,6 +505,14 @@ class Modules:
         self.inline_handlers = {}
         self.callback_handlers = {}
         self.aliases = {}
+        # Lowercased command or alias -> command, rebuilt on every change
+        # of commands or aliases
+        self._routes: typing.Dict[str, str] = {}
+        self._command_aliases: typing.Dict[str, str] = {}
+        # Alias -> commands, which declare it. The earliest registered one wins
+        self._declared_aliases: typing.Dict[str, typing.Set[str]] = {}
+        self._command_order: typing.Dict[str, int] = {}
+        self._next_order = itertools.count()
         self.modules = []  # skipcq: PTC-W0052
         self.libraries = []
         self.watchers = []
@@ -534,7 +545,15 @@ class Modules:
                 callback_handlers.update(module.callback_handlers)
                 watchers.extend(module.legacy_watchers.values())
 
-            self.commands = commands
+            if commands.keys() != self.commands.keys():
+                self.commands = commands
+                self._rebuild_routes()
+            else:
+                self.commands = commands
+
+            # Commands may be new functions even if names are the same
+            self._index_security()
+
             self.inline_handlers = inline_handlers
             self.callback_handlers = callback_handlers
             self.watchers = watchers
@@ -677,11 +696,86 @@ class Modules:
         for alias, cmd in aliases.items():
             self.add_alias(alias, cmd)
 
+    def _rebuild_routes(self):
+        """
+        Rebuild routing table, used by `dispatch` and `find_alias`, from scratch.
+        Used only when commands are replaced at once, single changes update
+        affected entries
+        """
+        self._routes = {}
+        self._command_aliases = {}
+        self._declared_aliases = {}
+        self._command_order = {}
+        for command_name in self.commands:
+            self._add_command_routes(command_name)
+
+        for alias in self.aliases:
+            self._update_route(alias)
+
+    @staticmethod
+    def _declared(command: callable) -> typing.List[str]:
+        return [
+            alias.lower()
+            for alias in getattr(command, "aliases", None) or (
+                [command.alias] if getattr(command, "alias", None) else []
+            )
+        ]
+
+    def _update_route(self, name: str):
+        """
+        Recompute route of single command or alias.
+        Commands take precedence over user aliases, which take precedence
+        over aliases, declared by modules
+        """
+        if (owners := self._declared_aliases.get(name)) and (
+            name not in self._core_commands
+        ):
+            self._command_aliases[name] = min(owners, key=self._command_order.get)
+        else:
+            self._command_aliases.pop(name, None)
+
+        if name in self.commands:
+            self._routes[name] = name
+        elif (cmd := self.aliases.get(name)) and cmd.lower() in self.commands:
+            self._routes[name] = cmd
+        elif name in self._command_aliases:
+            self._routes[name] = self._command_aliases[name]
+        else:
+            self._routes.pop(name, None)
+
+    def _add_command_routes(self, command_name: str):
+        """Route registered command and aliases, declared by it"""
+        self._command_order.setdefault(command_name, next(self._next_order))
+        for alias in self._declared(self.commands[command_name]):
+            self._declared_aliases.setdefault(alias, set()).add(command_name)
+            self._update_route(alias)
+
+        self._update_route(command_name)
+
+    def _remove_command_routes(self, command_name: str, command: callable):
+        """Unroute unregistered or replaced command and aliases, declared by it"""
+        if command_name not in self.commands:
+            self._command_order.pop(command_name, None)
+
+        for alias in self._declared(command):
+            if command_name in (owners := self._declared_aliases.get(alias, set())):
+                owners.discard(command_name)
+                if not owners:
+                    del self._declared_aliases[alias]
+
+            self._update_route(alias)
+
+        self._update_route(command_name)
+
+    def _index_security(self):
+        """Precompute security flags of registered commands"""
+        self.client.dispatcher.security.index_handlers(self.commands.values())
+
     def register_raw_handlers(self, instance: Module):
         """Register event handlers for a module"""
         for name, handler in utils.iter_attrs(instance):
             if getattr(handler, "is_raw_handler", False):
-                self.client.dispatcher.raw_handlers.append(handler)
+                self.client.dispatcher.add_raw_handler(handler)
                 logger.debug(
                     "Registered raw handler %s for %s. ID: %s",
                     name,
@@ -710,12 +804,17 @@ class Modules:
 
                 raise CoreOverwriteError(command=_command)
 
-            self.commands.update({_command.lower(): cmd})
+            if (name := _command.lower()) in self.commands:
+                self._remove_command_routes(name, self.commands[name])
+
+            self.commands.update({name: cmd})
+            self._add_command_routes(name)
 
         for alias, cmd in self.aliases.copy().items():
             if cmd in instance.commands:
                 self.add_alias(alias, cmd)
 
+        self._index_security()
         self.register_inline_stuff(instance)
 
     def register_inline_stuff(self, instance: Module):
@@ -882,24 +981,8 @@ class Modules:
         if not alias:
             return None
 
-        for command_name, _command in self.commands.items():
-            aliases = []
-            if getattr(_command, "alias", None) and not (
-                aliases := getattr(_command, "aliases", None)
-            ):
-                aliases = [_command.alias]
-            if getattr(_command, "aliases", None):
-                aliases = _command.aliases
-
-            if not aliases:
-                continue
-
-            if any(
-                alias.lower() == _alias.lower()
-                and alias.lower() not in self._core_commands
-                for _alias in aliases
-            ):
-                return command_name
+        if command_name := self._command_aliases.get(alias.lower()):
+            return command_name
 
         if alias in self.aliases and include_legacytl:
             return self.aliases[alias]
@@ -908,18 +991,12 @@ class Modules:
 
     def dispatch(self, _command: str) -> typing.Tuple[str, typing.Optional[str]]:
         """Dispatch command to appropriate module"""
+        if not (cmd := self._routes.get(_command.lower())):
+            return _command, None
 
-        return next(
-            (
-                (cmd, self.commands[cmd.lower()])
-                for cmd in [
-                    _command,
-                    self.aliases.get(_command.lower()),
-                    self.find_alias(_command),
-                ]
-                if cmd and cmd.lower() in self.commands
-            ),
-            (_command, None),
+        return (
+            _command if cmd == _command.lower() else cmd,
+            self.commands[cmd.lower()],
         )
 
     def send_config(self, skip_hook: bool = False):
@@ -1114,9 +1191,13 @@ class Modules:
                     purpose,
                 )
                 del self.commands[name]
+                self._remove_command_routes(name, cmd)
                 for alias, _command in self.aliases.copy().items():
                     if _command == name:
                         del self.aliases[alias]
+                        self._update_route(alias)
+
+        self._index_security()
 
     def unregister_watchers(self, instance: Module, purpose: str):
         for _watcher in self.watchers.copy():
@@ -1131,9 +1212,9 @@ class Modules:
 
     def unregister_raw_handlers(self, instance: Module, purpose: str):
         """Unregister event handlers for a module"""
-        for handler in self.client.dispatcher.raw_handlers:
+        for handler in self.client.dispatcher.raw_handlers.copy():
             if handler.__self__.__class__.__name__ == instance.__class__.__name__:
-                self.client.dispatcher.raw_handlers.remove(handler)
+                self.client.dispatcher.remove_raw_handler(handler)
                 logger.debug(
                     "Unregistered raw handler of module %s for %s. ID: %s",
                     instance.__class__.__name__,
@@ -1146,12 +1227,16 @@ class Modules:
         if cmd not in self.commands:
             return False
 
-        self.aliases[alias.lower().strip()] = cmd
+        self.aliases[alias := alias.lower().strip()] = cmd
+        self._update_route(alias)
         return True
 
     def remove_alias(self, alias: str) -> bool:
         """Remove an alias"""
-        return bool(self.aliases.pop(alias.strip(), None))
+        if removed := bool(self.aliases.pop(alias := alias.strip(), None)):
+            self._update_route(alias)
+
+        return removed
 
     async def log(self, *args, **kwargs):
         """Unnecessary placeholder for logging"""
@@ -23,6 +23,7 @@ import legacytl
 from aiogram.exceptions import TelegramNetworkError as NetworkError
 from aiogram.exceptions import TelegramRetryAfter as RetryAfter
 from legacytl.errors.rpcbaseerrors import RPCError, ServerError
+from legacytl.tl.tlobject import TLObject
 
 from . import utils
 from .tl_cache import CustomTelegramClient
@@ -56,6 +57,80 @@ def getlines(filename: str, module_globals=None) -> str:
 linecache.getlines = getlines
 
 
+# `phone=...` of reprs and `"phone": ...` of dicts and JSON
+_PHONE = re.compile(r"""(\bphone['"]?\s*[=:]\s*)(?:(['"])([^'"\n]*)\2|(\+?\d+))""")
+
+
+def redact_text(text: str) -> str:
+    """Redact phone numbers in reprs, dicts and JSON of legacytl objects"""
+    if "phone" not in text:
+        return text
+
+    return _PHONE.sub(
+        lambda m: (
+            m.group(0)
+            if not (value := m.group(3) or m.group(4)) or value.startswith("redacted_")
+            else "{}{}redacted_{}_chars{}".format(
+                m.group(1),
+                m.group(2) or "",
+                len(value),
+                m.group(2) or "",
+            )
+        ),
+        text,
+    )
+
+
+def _redact(value: typing.Any) -> typing.Any:
+    if isinstance(value, TLObject):
+        return TLObject.pretty_format(utils.redact(value))
+
+    if isinstance(value, str):
+        return redact_text(value)
+
+    # Events and other wrappers of legacytl objects are rendered
+    # as text anyway, so they are redacted in advance
+    if type(value).__module__.startswith("legacytl") and "phone" in (
+        text := str(value)
+    ):
+        return redact_text(text)
+
+    return value
+
+
+def redact_record(record: logging.LogRecord):
+    """
+    Redact legacytl objects, text and traceback of record before it's
+    formatted. Record is redacted once, even if it's passed to several handlers
+    """
+    if getattr(record, "legacy_redacted", False):
+        return
+
+    record.legacy_redacted = True
+    record.msg = _redact(record.msg)
+    if isinstance(record.args, tuple):
+        record.args = tuple(map(_redact, record.args))
+    elif isinstance(record.args, dict):
+        record.args = {k: _redact(v) for k, v in record.args.items()}
+
+    if record.exc_info and not record.exc_text:
+        record.exc_text = _main_formatter.formatException(record.exc_info)
+
+    if record.exc_text:
+        record.exc_text = redact_text(record.exc_text)
+
+    if record.stack_info:
+        record.stack_info = redact_text(record.stack_info)
+
+
+class RedactingFilter(logging.Filter):
+    """Redacts records before handler, it's attached to, formats them"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        redact_record(record)
+        return True
+
+
 def override_text(exception: Exception) -> typing.Optional[str]:
     """Returns error-specific description if available, else `None`"""
     if isinstance(exception, NetworkError):
@@ -123,7 +198,7 @@ class LegacyException:
 
             return dictionary
 
-        full_traceback = traceback.format_exc().replace(
+        full_traceback = redact_text(traceback.format_exc()).replace(
             "Traceback (most recent call last):\n",
             "",
         )
@@ -185,9 +260,11 @@ class LegacyException:
                 lineno,
                 utils.escape_html(name),
                 utils.escape_html(
-                    "".join(
-                        traceback.format_exception_only(exc_type, exc_value)
-                    ).strip()
+                    redact_text(
+                        "".join(
+                            traceback.format_exception_only(exc_type, exc_value)
+                        ).strip()
+                    )
                 ),
                 (
                     "\n💭 <b>Message:</b>"
@@ -510,6 +587,7 @@ rotating_handler = RotatingFileHandler(
 )
 
 rotating_handler.setFormatter(_main_formatter)
+_redacting_filter = RedactingFilter()
 
 
 def init():
@@ -517,9 +595,11 @@ def init():
     handler.setLevel(logging.INFO)
     handler.setFormatter(_main_formatter)
     logging.getLogger().handlers = []
-    logging.getLogger().addHandler(
-        TelegramLogsHandler((handler, rotating_handler), 7000)
-    )
+    tg_handler = TelegramLogsHandler((handler, rotating_handler), 7000)
+    for target in (tg_handler, handler, rotating_handler):
+        target.addFilter(_redacting_filter)
+
+    logging.getLogger().addHandler(tg_handler)
     logging.getLogger().setLevel(logging.NOTSET)
     logging.getLogger("legacytl").setLevel(logging.WARNING)
     logging.getLogger("matplotlib").setLevel(logging.WARNING)
@@ -856,9 +856,10 @@ class Legacy:
         dispatcher = CommandDispatcher(modules, client, db)
         client.dispatcher = dispatcher
         modules.check_security = dispatcher.check_security
+        modules.check_security_many = dispatcher.check_security_many
 
         client.add_event_handler(
-            dispatcher.handle_incoming,
+            dispatcher.handle_new_message,
             events.NewMessage(),
         )
 
@@ -867,11 +868,6 @@ class Legacy:
             events.ChatAction(),
         )
 
-        client.add_event_handler(
-            dispatcher.handle_command,
-            events.NewMessage(forwards=False),
-        )
-
         client.add_event_handler(
             dispatcher.handle_command,
             events.MessageEdited(),
@@ -946,6 +942,8 @@ class Legacy:
         for client in self.clients:
             client.disconnect()
 
+        database.flush_all()
+
         sys.exit(0)
 
     def main(self):
@@ -0,0 +1,156 @@
+"""Latency and throughput of commands and watchers"""
+
+import typing
+
+# Each power of two is split into 4 buckets, so percentiles are off by 12% at most
+_SUBBUCKETS = 4
+_BUCKETS = 64 * _SUBBUCKETS
+
+PERCENTILES = (0.5, 0.95, 0.99)
+
+
+def _bucket(ns: int) -> int:
+    if ns < _SUBBUCKETS:
+        return max(ns, 0)
+
+    bits = ns.bit_length()
+    return (bits - 1) * _SUBBUCKETS + ((ns >> (bits - 3)) & (_SUBBUCKETS - 1))
+
+
+def _lower_bound(bucket: int) -> int:
+    if bucket < 2 * _SUBBUCKETS:
+        # Buckets between exact small values and the first split power are unused
+        return min(bucket, _SUBBUCKETS)
+
+    return (_SUBBUCKETS + bucket % _SUBBUCKETS) << (bucket // _SUBBUCKETS - 2)
+
+
+class Histogram:
+    """Log-scale histogram of durations in nanoseconds"""
+
+    __slots__ = ("counts", "count", "total")
+
+    def __init__(self):
+        self.counts = [0] * _BUCKETS
+        self.count = 0
+        self.total = 0
+
+    def add(self, ns: int):
+        self.counts[min(_bucket(ns), _BUCKETS - 1)] += 1
+        self.count += 1
+        self.total += ns
+
+    def percentile(self, q: float) -> float:
+        """
+        Estimate percentile
+        :param q: Percentile from 0 to 1
+        :return: Duration in nanoseconds
+        """
+        if not self.count:
+            return 0.0
+
+        rank = max(1, round(q * self.count))
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return (_lower_bound(bucket) + _lower_bound(bucket + 1)) / 2
+
+        return float(_lower_bound(_BUCKETS))
+
+    def as_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "mean_ms": self.total / self.count / 1e6 if self.count else 0.0,
+            **{f"p{round(q * 100)}_ms": self.percentile(q) / 1e6 for q in PERCENTILES},
+        }
+
+
+class HandlerStats:
+    """Counters of single command or watcher"""
+
+    __slots__ = ("name", "kind", "errors", "handler", "queue", "security", "tags")
+
+    def __init__(self, name: str, kind: str):
+        self.name = name
+        self.kind = kind
+        self.errors = 0
+        # Time spent in handler itself
+        self.handler = Histogram()
+        # Time between scheduling handler and its start
+        self.queue = Histogram()
+        # Total time spent in security checks and tag filters
+        self.security = 0
+        self.tags = 0
+
+    @property
+    def invocations(self) -> int:
+        return self.handler.count
+
+    def as_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "kind": self.kind,
+            "invocations": self.invocations,
+            "errors": self.errors,
+            "handler": self.handler.as_dict(),
+            "queue": self.queue.as_dict(),
+            "security_ms": self.security / 1e6,
+            "tags_ms": self.tags / 1e6,
+        }
+
+
+class Metrics:
+    """
+    Per-handler statistics of dispatcher. Collected only while `enabled`
+    is set, call sites check it before taking any timings
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self._handlers: typing.Dict[typing.Tuple[str, str], HandlerStats] = {}
+
+    @staticmethod
+    def name(func: callable) -> str:
+        """
+        Get name, which handler is reported under
+        :param func: Command or watcher
+        :return: `Module.method`
+        """
+        return f"{func.__self__.__class__.__name__}.{func.__name__}"
+
+    def of(self, func: callable, kind: str) -> HandlerStats:
+        """
+        Get statistics of handler, creating it if needed
+        :param func: Command or watcher
+        :param kind: `command` or `watcher`
+        :return: Statistics
+        """
+        key = (self.name(func), kind)
+        if (stats := self._handlers.get(key)) is None:
+            stats = self._handlers[key] = HandlerStats(*key)
+
+        return stats
+
+    def reset(self):
+        self._handlers.clear()
+
+    def snapshot(self) -> typing.List[dict]:
+        """
+        Get statistics of all handlers
+        :return: List of dicts, see `HandlerStats.as_dict`
+        """
+        return [stats.as_dict() for stats in self._handlers.values()]
+
+    def top(self, n: int = 10, percentile: float = 0.95) -> typing.List[HandlerStats]:
+        """
+        Get the slowest handlers
+        :param n: Number of handlers
+        :param percentile: Percentile of handler latency to sort by
+        :return: Statistics of handlers, the slowest first
+        """
+        return sorted(
+            self._handlers.values(),
+            key=lambda stats: stats.handler.percentile(percentile),
+            reverse=True,
+        )[:n]
@@ -17,6 +17,7 @@ from io import StringIO
 import legacytl
 from legacytl.errors.rpcerrorlist import MessageIdInvalidError
 from legacytl.sessions import StringSession
+from legacytl.tl.tlobject import TLObject
 from legacytl.tl.types import Message
 from legacytl.tl.types.messages import AffectedMessages
 from meval import meval
@@ -93,7 +94,11 @@ class Evaluator(loader.Module):
 
         if callable(getattr(result, "stringify", None)):
             with contextlib.suppress(Exception):
-                result = str(result.stringify())
+                result = (
+                    TLObject.pretty_format(utils.redact(result), indent=0)
+                    if isinstance(result, TLObject)
+                    else str(result.stringify())
+                )
         else:
             result = str(result)
 
@@ -198,8 +198,14 @@ class Help(loader.Module):
 
         commands = {
             name: func
-            for name, func in module.commands.items()
-            if await self.allmodules.check_security(message, func)
+            for (name, func), allowed in zip(
+                module.commands.items(),
+                await self.allmodules.check_security_many(
+                    message,
+                    list(module.commands.values()),
+                ),
+            )
+            if allowed
         }
 
         if hasattr(module, "inline_handlers"):
@@ -274,6 +280,39 @@ class Help(loader.Module):
 
         hidden = self.get("hide", [])
 
+        allowed = set()
+        if not force:
+            # Sender is resolved once for all commands of all modules
+            funcs = [
+                func
+                for mod in self.allmodules.modules
+                for func in getattr(mod, "commands", {}).values()
+            ]
+            allowed.update(
+                func
+                for func, permitted in zip(
+                    funcs,
+                    await self.allmodules.check_security_many(message, funcs),
+                )
+                if permitted
+            )
+            funcs = [
+                func
+                for mod in self.allmodules.modules
+                for func in getattr(mod, "inline_handlers", {}).values()
+            ]
+            allowed.update(
+                func
+                for func, permitted in zip(
+                    funcs,
+                    await self.inline.check_inline_security_many(
+                        funcs=funcs,
+                        user=message.sender_id,
+                    ),
+                )
+                if permitted
+            )
+
         plain_ = []
         core_ = []
         no_commands_ = []
@@ -308,9 +347,7 @@ class Help(loader.Module):
             first = True
 
             commands = [
-                name
-                for name, func in mod.commands.items()
-                if await self.allmodules.check_security(message, func) or force
+                name for name, func in mod.commands.items() if force or func in allowed
             ]
 
             if self.config["show_cmds"]:
@@ -324,11 +361,7 @@ class Help(loader.Module):
             icommands = [
                 name
                 for name, func in mod.inline_handlers.items()
-                if await self.inline.check_inline_security(
-                    func=func,
-                    user=message.sender_id,
-                )
-                or force
+                if force or func in allowed
             ]
 
             if self.config["show_cmds"]:
@@ -136,6 +136,7 @@ class LegacyBackupMod(loader.Module):
                 self.get("last_backup") + self.get("period") - time.time()
             )
 
+            self._db.load_all()
             db_dump = ujson.dumps(self._db).encode()
 
             result = io.BytesIO()
@@ -255,6 +256,7 @@ class LegacyBackupMod(loader.Module):
 
     @loader.command()
     async def backup(self, message):
+        self._db.load_all()
         db_dump = ujson.dumps(self._db).encode()
 
         result = io.BytesIO()
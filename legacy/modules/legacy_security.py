@@ -619,10 +619,9 @@ class LegacySecurityMod(loader.Module):
 
         if user.id in self._client.dispatcher.security.owner:
             self._client.dispatcher.security.owner.remove(user.id)
-        try:
-            self._db.get(main.__name__, "command_prefix", {}).pop(f"{user.id}")
-        except KeyError:
-            pass
+        prefixes = self._db.get(main.__name__, "command_prefix", {})
+        if prefixes.pop(f"{user.id}", None) is not None:
+            self._db.set(main.__name__, "command_prefix", prefixes)
 
         await utils.answer(
             message,
@@ -110,37 +110,49 @@ class LoaderMod(loader.Module):
 
     @loader.loop(interval=3, wait_before=True, autostart=True)
     async def _config_autosaver(self):
-        for mod in self.allmodules.modules:
-            if (
-                not hasattr(mod, "config")
-                or not mod.config
-                or not isinstance(mod.config, loader.ModuleConfig)
-            ):
-                continue
+        # All changed options are written in one transaction, so the
+        # database is saved once per tick instead of once per option
+        saved = []
+        with self._db.transaction():
+            for mod in self.allmodules.modules:
+                if (
+                    not hasattr(mod, "config")
+                    or not mod.config
+                    or not isinstance(mod.config, loader.ModuleConfig)
+                ):
+                    continue
+
+                if changed := self._changed_options(mod.config, saved):
+                    mod.pointer("__config__", {}).update(changed)
 
-            for option, config in mod.config._config.items():
-                if not hasattr(config, "_save_marker"):
+            for lib in self.allmodules.libraries:
+                if (
+                    not hasattr(lib, "config")
+                    or not lib.config
+                    or not isinstance(lib.config, loader.ModuleConfig)
+                ):
                     continue
 
-                delattr(mod.config._config[option], "_save_marker")
-                mod.pointer("__config__", {})[option] = config.value
+                if changed := self._changed_options(lib.config, saved):
+                    lib._lib_pointer("__config__", {}).update(changed)
 
-        for lib in self.allmodules.libraries:
-            if (
-                not hasattr(lib, "config")
-                or not lib.config
-                or not isinstance(lib.config, loader.ModuleConfig)
-            ):
-                continue
+        # Markers are cleared only once transaction is committed,
+        # so options are saved again on the next tick if it fails
+        for value in saved:
+            with contextlib.suppress(AttributeError):
+                delattr(value, "_save_marker")
 
-            for option, config in lib.config._config.items():
-                if not hasattr(config, "_save_marker"):
-                    continue
+    @staticmethod
+    def _changed_options(config: loader.ModuleConfig, saved: list) -> dict:
+        changed = {}
+        for option, value in config._config.items():
+            if not hasattr(value, "_save_marker"):
+                continue
 
-                delattr(lib.config._config[option], "_save_marker")
-                lib._lib_pointer("__config__", {})[option] = config.value
+            saved.append(value)
+            changed[option] = value.value
 
-        self._db.save()
+        return changed
 
     def update_modules_in_db(self):
         self.set(
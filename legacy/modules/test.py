@@ -414,6 +414,70 @@ class TestMod(loader.Module):
         except ValueError:
             await utils.answer(message, self.strings("suspend_invalid_time"))
 
+    @loader.command()
+    async def handlers(self, message: Message):
+        args = utils.get_args_raw(message).lower()
+        metrics = self._client.dispatcher.metrics
+
+        if args in {"on", "off"}:
+            metrics.enabled = args == "on"
+            self.set("handler_metrics", metrics.enabled)
+            await utils.answer(
+                message,
+                self.strings(
+                    "handler_metrics_on" if metrics.enabled else "handler_metrics_off"
+                ),
+            )
+            return
+
+        if args == "reset":
+            metrics.reset()
+            await utils.answer(message, self.strings("handler_metrics_reset"))
+            return
+
+        top = metrics.top(int(args) if args.isdigit() else 10)
+        if not top:
+            await utils.answer(
+                message,
+                self.strings("no_handler_metrics")
+                + (
+                    ""
+                    if metrics.enabled
+                    else "\n" + self.strings("handler_metrics_hint")
+                ),
+            )
+            return
+
+        queue = self._client.dispatcher.scheduler.stats()
+        await utils.answer(
+            message,
+            self.strings("handler_metrics")
+            + "\n\n"
+            + "\n\n".join(
+                self.strings("handler_metrics_line").format(
+                    name=utils.escape_html(stats.name),
+                    kind=stats.kind,
+                    calls=stats.invocations,
+                    errors=stats.errors,
+                    p50=stats.handler.percentile(0.5) / 1e6,
+                    p95=stats.handler.percentile(0.95) / 1e6,
+                    p99=stats.handler.percentile(0.99) / 1e6,
+                    queue=stats.queue.percentile(0.95) / 1e6,
+                    security=stats.security / 1e6,
+                    tags=stats.tags / 1e6,
+                )
+                for stats in top
+            )
+            + "\n\n"
+            + self.strings("handler_metrics_queue").format(
+                **{
+                    f"{name}_{field}": value
+                    for name, counters in queue.items()
+                    for field, value in counters.items()
+                }
+            ),
+        )
+
     @loader.command()
     async def ping(self, message):
         start = time.perf_counter_ns()
@@ -454,6 +518,7 @@ class TestMod(loader.Module):
             )
 
     async def client_ready(self):
+        self._client.dispatcher.metrics.enabled = self.get("handler_metrics", False)
         self._content_channel_id = await utils.wait_for_content_channel(self._db)
 
         await utils.fw_protect()
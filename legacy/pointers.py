@@ -4,6 +4,7 @@
 # You can redistribute it and/or modify it under the terms of the GNU AGPLv3
 # 🔑 https://www.gnu.org/licenses/agpl-3.0.html
 
+import contextlib
 import typing
 
 
@@ -21,6 +22,8 @@ class PointerList(list):
         self._module = module
         self._key = key
         self._default = default
+        self._batch_depth = 0
+        self._batch_dirty = False
         super().__init__(db.get(module, key, default))
 
     @property
@@ -29,9 +32,35 @@ class PointerList(list):
 
     @data.setter
     def data(self, value: list):
-        self.clear()
-        self.extend(value)
-        self._save()
+        with self.batch():
+            self.clear()
+            self.extend(value)
+
+    @contextlib.contextmanager
+    def batch(self) -> typing.Iterator["PointerList"]:
+        """
+        Apply several mutations and save the list to database only once
+        on exit. If the block raises, the list is restored and nothing is saved
+        """
+        backup = list(self)
+        self._batch_depth += 1
+
+        try:
+            yield self
+        except BaseException:
+            self._batch_depth -= 1
+            super().clear()
+            super().extend(backup)
+            if not self._batch_depth:
+                self._batch_dirty = False
+
+            raise
+
+        self._batch_depth -= 1
+
+        if not self._batch_depth and self._batch_dirty:
+            self._batch_dirty = False
+            self._save()
 
     def __repr__(self):
         return f"PointerList({list(self)})"
@@ -89,6 +118,10 @@ class PointerList(list):
         self._save()
 
     def _save(self):
+        if self._batch_depth:
+            self._batch_dirty = True
+            return
+
         self._db.set(self._module, self._key, list(self))
 
     def tolist(self):
@@ -109,6 +142,8 @@ class PointerDict(dict):
         self._module = module
         self._key = key
         self._default = default
+        self._batch_depth = 0
+        self._batch_dirty = False
         super().__init__(db.get(module, key, default))
 
     @property
@@ -117,9 +152,35 @@ class PointerDict(dict):
 
     @data.setter
     def data(self, value: dict):
-        self.clear()
-        self.update(value)
-        self._save()
+        with self.batch():
+            self.clear()
+            self.update(value)
+
+    @contextlib.contextmanager
+    def batch(self) -> typing.Iterator["PointerDict"]:
+        """
+        Apply several mutations and save the dict to database only once
+        on exit. If the block raises, the dict is restored and nothing is saved
+        """
+        backup = dict(self)
+        self._batch_depth += 1
+
+        try:
+            yield self
+        except BaseException:
+            self._batch_depth -= 1
+            super().clear()
+            super().update(backup)
+            if not self._batch_depth:
+                self._batch_dirty = False
+
+            raise
+
+        self._batch_depth -= 1
+
+        if not self._batch_depth and self._batch_dirty:
+            self._batch_dirty = False
+            self._save()
 
     def __repr__(self):
         return f"PointerDict({dict(self)})"
@@ -162,6 +223,10 @@ class PointerDict(dict):
         self._save()
 
     def _save(self):
+        if self._batch_depth:
+            self._batch_dirty = True
+            return
+
         self._db.set(self._module, self._key, dict(self))
 
     def todict(self):
@@ -218,6 +283,9 @@ class BaseSerializingMiddlewareDict:
     def clear(self) -> None:
         self._pointer.clear()
 
+    def batch(self) -> typing.ContextManager[PointerDict]:
+        return self._pointer.batch()
+
     def todict(self) -> dict:
         return {
             key: self.deserialize(value) for key, value in self._pointer.data.items()
@@ -282,6 +350,9 @@ class BaseSerializingMiddlewareList:
     def __repr__(self) -> str:
         return f"{self.__class__.__name__}({self._pointer})"
 
+    def batch(self) -> typing.ContextManager[PointerList]:
+        return self._pointer.batch()
+
     def tolist(self) -> list:
         return [self.deserialize(item) for item in self._pointer.data]
 
@@ -0,0 +1,178 @@
+"""Bounded execution of command and watcher handlers"""
+
+import asyncio
+import collections
+import logging
+import typing
+
+logger = logging.getLogger(__name__)
+
+# Priorities, lower runs first
+OWNER_COMMAND = 0
+COMMAND = 1
+WATCHER = 2
+PRIORITIES = (OWNER_COMMAND, COMMAND, WATCHER)
+
+MAX_RUNNING = 64
+# Slots, which watchers can't take, so commands never wait behind them
+RESERVED_FOR_COMMANDS = 8
+MAX_RUNNING_PER_MODULE = 8
+# Slots of each module, which its watchers can't take, so busy watchers
+# don't starve commands of the same module
+RESERVED_PER_MODULE_FOR_COMMANDS = 2
+# Queued jobs of each priority. When it's exceeded, the oldest job
+# of the module with the longest queue is dropped
+QUEUE_LIMIT = 1000
+
+
+class Job:
+    __slots__ = ("factory", "module")
+
+    def __init__(self, factory: typing.Callable[[], typing.Awaitable], module: str):
+        self.factory = factory
+        self.module = module
+
+
+class Scheduler:
+    """
+    Runs handlers with global and per-module concurrency limits. Part of both
+    of them is reserved for commands. Jobs, which can't be started right away,
+    are queued and started as soon as slot is free, higher priorities first.
+    Queues of the same priority are served round-robin by module. Owner commands
+    are never limited, so busy modules can't lock owner out
+    """
+
+    def __init__(
+        self,
+        max_running: int = MAX_RUNNING,
+        reserved: int = RESERVED_FOR_COMMANDS,
+        per_module: int = MAX_RUNNING_PER_MODULE,
+        reserved_per_module: int = RESERVED_PER_MODULE_FOR_COMMANDS,
+        queue_limit: int = QUEUE_LIMIT,
+    ):
+        self._max_running = max_running
+        self._reserved = reserved
+        self._per_module = per_module
+        self._watchers_per_module = max(per_module - reserved_per_module, 1)
+        self._queue_limit = queue_limit
+        self._queues: typing.Dict[int, typing.Dict[str, typing.Deque[Job]]] = {
+            priority: {} for priority in PRIORITIES
+        }
+        self._queued = collections.Counter()
+        self._running = 0
+        self._running_by_priority = collections.Counter()
+        self._running_by_module = collections.Counter()
+        self._tasks: typing.Set[asyncio.Future] = set()
+        self.dropped = collections.Counter()
+
+    def submit(
+        self,
+        priority: int,
+        module: str,
+        factory: typing.Callable[[], typing.Awaitable],
+    ):
+        """
+        Schedule handler
+        :param priority: One of `OWNER_COMMAND`, `COMMAND` or `WATCHER`
+        :param module: Name of module, which handler belongs to
+        :param factory: Function, which returns coroutine to run
+        """
+        job = Job(factory, module)
+        if self._can_start(priority, module):
+            self._start(priority, job)
+            return
+
+        self._queues[priority].setdefault(module, collections.deque()).append(job)
+        self._queued[priority] += 1
+        if self._queued[priority] > self._queue_limit:
+            self._drop(priority)
+
+    def _can_start(self, priority: int, module: str) -> bool:
+        if priority == OWNER_COMMAND:
+            return True
+
+        if priority == WATCHER:
+            limit = self._max_running - self._reserved
+            module_limit = self._watchers_per_module
+        else:
+            limit = self._max_running
+            module_limit = self._per_module
+
+        return self._running < limit and self._running_by_module[module] < module_limit
+
+    def _drop(self, priority: int):
+        queues = self._queues[priority]
+        module = max(queues, key=lambda name: len(queues[name]))
+        queues[module].popleft()
+        if not queues[module]:
+            del queues[module]
+
+        self._queued[priority] -= 1
+        self.dropped[priority] += 1
+        logger.debug("Dropped queued handler of %s", module)
+
+    def _start(self, priority: int, job: Job):
+        self._running += 1
+        self._running_by_priority[priority] += 1
+        self._running_by_module[job.module] += 1
+
+        try:
+            task = asyncio.ensure_future(job.factory())
+        except Exception:
+            logger.exception("Unable to start handler of %s", job.module)
+            self._finish(priority, job.module)
+            return
+
+        self._tasks.add(task)
+        task.add_done_callback(lambda task: self._on_done(task, priority, job.module))
+
+    def _on_done(self, task: asyncio.Future, priority: int, module: str):
+        self._tasks.discard(task)
+        self._finish(priority, module)
+        self._pump()
+
+    def _finish(self, priority: int, module: str):
+        self._running -= 1
+        self._running_by_priority[priority] -= 1
+        self._running_by_module[module] -= 1
+        if not self._running_by_module[module]:
+            del self._running_by_module[module]
+
+    def _pump(self):
+        """Start queued jobs while there are free slots"""
+        for priority in PRIORITIES:
+            queues = self._queues[priority]
+            started = True
+            while queues and started:
+                started = False
+                for module in list(queues):
+                    if not self._can_start(priority, module):
+                        continue
+
+                    queue = queues.pop(module)
+                    job = queue.popleft()
+                    if queue:
+                        # Move module to the end to serve modules in turn
+                        queues[module] = queue
+
+                    self._queued[priority] -= 1
+                    self._start(priority, job)
+                    started = True
+
+    def stats(self) -> dict:
+        """
+        Get queue depth and counters
+        :return: Dict with running, queued and dropped jobs by priority
+        """
+        return {
+            name: {
+                "running": self._running_by_priority[priority],
+                "queued": self._queued[priority],
+                "dropped": self.dropped[priority],
+            }
+            for name, priority in (
+                ("owner_commands", OWNER_COMMAND),
+                ("commands", COMMAND),
+                ("watchers", WATCHER),
+            )
+        }
@@ -22,6 +22,8 @@
 # You can redistribute it and/or modify it under the terms of the GNU AGPLv3
 # 🔑 https://www.gnu.org/licenses/agpl-3.0.html
 
+import asyncio
+import heapq
 import logging
 import time
 import typing
@@ -32,6 +34,7 @@ from legacytl.tl.types import ChatParticipantAdmin, ChatParticipantCreator, Mess
 from legacytl.utils import get_display_name
 
 from . import main, utils
+from ._ttl_cache import TTLCache
 from .database import Database
 from .tl_cache import CustomTelegramClient
 from .types import Command
@@ -162,13 +165,24 @@ def _sec(func: Command, flags: int) -> Command:
     return func
 
 
+# Time, during which lookups of edited posts in the same channel are batched
+_ADMIN_LOG_BATCH_DELAY = 0.05
+
+
 class SecurityManager:
     """Manages command execution security policy"""
 
     def __init__(self, client: CustomTelegramClient, db: Database):
         self._client = client
         self._db = db
-        self._cache: typing.Dict[int, dict] = {}
+        # Chats, permissions of channel participants and participants of groups
+        self._cache = TTLCache(max_size=1024, ttl=5 * 60, stale=60)
+        # (channel ID, message ID) -> (edit date, user ID) of edited channel posts
+        self._editors = TTLCache(max_size=4096, ttl=60 * 60, stale=0)
+        # Channel ID -> admin log request and IDs of posts it's awaited for
+        self._editor_batches: typing.Dict[
+            int, typing.Tuple[asyncio.Future, typing.Set[int]]
+        ] = {}
         self._last_warning: int = 0
         self._sgroups: typing.Dict[str, SecurityGroup] = {}
 
@@ -178,11 +192,95 @@ class SecurityManager:
         self._tsec_user = self.tsec_user = db.pointer(__name__, "tsec_user", [])
         self._owner = self.owner = db.pointer(__name__, "owner", [])
 
+        # (target type, target ID, rule type, rule) -> expiration time, 0 if never.
+        # Lists in database are kept for persistence and are indexed on change
+        self._rules: typing.Dict[typing.Tuple[str, int, str, str], int] = {}
+        self._expiry: typing.List[typing.Tuple[int, tuple]] = []
+        # (user ID, rule type, rule) of all security groups
+        self._sgroup_rules: typing.Set[typing.Tuple[int, str, str]] = set()
+        self._purge_scheduled = False
+
+        self._load_masks()
         self._reload_rights()
+        self._index_rules()
+        db.subscribe(__name__, None, self._on_change)
 
     def apply_sgroups(self, sgroups: typing.Dict[str, SecurityGroup]):
         """Apply security groups"""
         self._sgroups = sgroups
+        self._sgroup_rules = {
+            (user, permission["rule_type"], permission["rule"])
+            for group in sgroups.values()
+            for user in group.users
+            for permission in group.permissions
+        }
+
+    def _on_change(self, _: str, key: str):
+        if key in {"tsec_user", "tsec_chat"}:
+            self._index_rules()
+        elif key in {"masks", "bounding_mask"}:
+            self._load_masks()
+        elif key == "owner" and self._client.tg_id not in self._owner:
+            self._owner.append(self._client.tg_id)
+
+    def _index_rules(self):
+        """Rebuild index of targeted rules from database"""
+        now = time.time()
+        rules = {}
+        for target_type, pointer in (
+            ("user", self._tsec_user),
+            ("chat", self._tsec_chat),
+        ):
+            for info in pointer:
+                expires = info["expires"]
+                if expires and expires < now:
+                    continue
+
+                key = (target_type, info["target"], info["rule_type"], info["rule"])
+                rules[key] = (
+                    0
+                    if not expires or rules.get(key, expires) == 0
+                    else max(rules.get(key, 0), expires)
+                )
+
+        self._rules = rules
+        self._expiry = [(expires, key) for key, expires in rules.items() if expires]
+        heapq.heapify(self._expiry)
+
+    def _sweep(self):
+        """Drop expired rules from index. Database is cleaned up later"""
+        now = time.time()
+        expired = False
+        while self._expiry and self._expiry[0][0] < now:
+            expires, key = heapq.heappop(self._expiry)
+            if self._rules.get(key) == expires:
+                del self._rules[key]
+                expired = True
+
+        if expired and not self._purge_scheduled:
+            self._purge_scheduled = True
+            try:
+                asyncio.get_running_loop().call_soon(self._purge_expired)
+            except RuntimeError:
+                self._purge_expired()
+
+    def _purge_expired(self):
+        self._purge_scheduled = False
+        with self._db.transaction():
+            for pointer in (self._tsec_user, self._tsec_chat):
+                with pointer.batch():
+                    for info in pointer.copy():
+                        if info["expires"] and info["expires"] < time.time():
+                            pointer.remove(info)
+
+    def _has_rule(
+        self,
+        target_type: str,
+        target: typing.Optional[int],
+        rule_type: str,
+        rule: typing.Optional[str],
+    ) -> bool:
+        return (target_type, target, rule_type, rule) in self._rules
 
     def _reload_rights(self):
         """
@@ -193,13 +291,7 @@ class SecurityManager:
         if self._client.tg_id not in self._owner:
             self._owner.append(self._client.tg_id)
 
-        for info in self._tsec_user.copy():
-            if info["expires"] and info["expires"] < time.time():
-                self._tsec_user.remove(info)
-
-        for info in self._tsec_chat.copy():
-            if info["expires"] and info["expires"] < time.time():
-                self._tsec_chat.remove(info)
+        self._purge_expired()
 
     def add_rule(
         self,
@@ -253,15 +345,17 @@ class SecurityManager:
         any_ = False
 
         if target_type == "user":
-            for rule in self.tsec_user.copy():
-                if rule["target"] == target_id:
-                    self.tsec_user.remove(rule)
-                    any_ = True
+            with self.tsec_user.batch():
+                for rule in self.tsec_user.copy():
+                    if rule["target"] == target_id:
+                        self.tsec_user.remove(rule)
+                        any_ = True
         elif target_type == "chat":
-            for rule in self.tsec_chat.copy():
-                if rule["target"] == target_id:
-                    self.tsec_chat.remove(rule)
-                    any_ = True
+            with self.tsec_chat.batch():
+                for rule in self.tsec_chat.copy():
+                    if rule["target"] == target_id:
+                        self.tsec_chat.remove(rule)
+                        any_ = True
 
         return any_
 
@@ -278,15 +372,17 @@ class SecurityManager:
         any_ = False
 
         if target_type == "user":
-            for rule in self.tsec_user.copy():
-                if rule["target"] == target_id and rule["rule"] == rule_cont:
-                    self.tsec_user.remove(rule)
-                    any_ = True
+            with self.tsec_user.batch():
+                for rule in self.tsec_user.copy():
+                    if rule["target"] == target_id and rule["rule"] == rule_cont:
+                        self.tsec_user.remove(rule)
+                        any_ = True
         elif target_type == "chat":
-            for rule in self.tsec_chat.copy():
-                if rule["target"] == target_id and rule["rule"] == rule_cont:
-                    self.tsec_chat.remove(rule)
-                    any_ = True
+            with self.tsec_chat.batch():
+                for rule in self.tsec_chat.copy():
+                    if rule["target"] == target_id and rule["rule"] == rule_cont:
+                        self.tsec_chat.remove(rule)
+                        any_ = True
 
         return any_
 
@@ -299,22 +395,48 @@ class SecurityManager:
         """
 
         if isinstance(func, int):
-            config = func
-        else:
+            return self._compute_flags(func)
+
+        key = getattr(func, "__func__", func)
+        if (flags := self._flags.get(key)) is None:
             # Return masks there so user don't need to reboot
             # every time he changes permissions. It doesn't
             # decrease security at all, bc user anyway can
             # access this attribute
-            config = self._db.get(__name__, "masks", {}).get(
-                f"{func.__module__}.{func.__name__}",
-                getattr(func, "security", self._default),
+            flags = self._flags[key] = self._compute_flags(
+                self._masks.get(
+                    f"{func.__module__}.{func.__name__}",
+                    getattr(func, "security", self._default),
+                )
             )
 
+        return flags
+
+    def _compute_flags(self, config: int) -> int:
         if config & ~ALL and not config & EVERYONE:
             logger.error("Security config contains unknown bits")
             return False
 
-        return config & self._db.get(__name__, "bounding_mask", DEFAULT_PERMISSIONS)
+        return config & self._bounding_mask
+
+    def index_handlers(self, handlers: typing.Iterable[Command]):
+        """
+        Compute effective flags of handlers in advance. Flags of handlers,
+        which are not passed, are forgotten and computed again on demand
+        :param handlers: Registered handlers
+        """
+        self._flags = {}
+        for handler in handlers:
+            self.get_flags(handler)
+
+    def _load_masks(self):
+        self._masks = self._db.get(__name__, "masks", {})
+        self._bounding_mask = self._db.get(
+            __name__,
+            "bounding_mask",
+            DEFAULT_PERMISSIONS,
+        )
+        self._flags: typing.Dict[typing.Callable, int] = {}
 
     def _check_tsec_inline(self, user_id: int, command: str) -> bool:
         """
@@ -325,39 +447,27 @@ class SecurityManager:
         :return: True if permitted, False otherwise
         """
 
-        return command and any(
-            (
-                rule["target"] == user_id
-                and rule["rule_type"] == "inline"
-                and rule["rule"] == command
-            )
-            for rule in self._tsec_user
-        )
+        self._sweep()
+        return bool(command) and self._has_rule("user", user_id, "inline", command)
 
     def check_tsec(self, user_id: int, command: str) -> bool:
-        for info in self._sgroups.copy().values():
-            if user_id in info.users:
-                for permission in info.permissions:
-                    if (
-                        permission["rule_type"] == "command"
-                        and permission["rule"] == command
-                        or permission["rule_type"] == "module"
-                        and permission["rule"] == command
-                    ):
-                        return True
-
-        for info in self._tsec_user.copy():
-            if info["target"] == user_id and (
-                info["rule_type"] == "command"
-                and info["rule"] == command
-                or info["rule_type"] == "module"
-                and command in self._client.loader.commands
-                and info["rule"]
-                == self._client.loader.commands[command].__qualname__.split(".")[0]
-            ):
-                return True
+        # Both kinds of group rules are compared with command name
+        if any(
+            (user_id, rule_type, command) in self._sgroup_rules
+            for rule_type in ("command", "module")
+        ):
+            return True
 
-        return False
+        self._sweep()
+        return self._has_rule("user", user_id, "command", command) or (
+            command in self._client.loader.commands
+            and self._has_rule(
+                "user",
+                user_id,
+                "module",
+                self._client.loader.commands[command].__qualname__.split(".")[0],
+            )
+        )
 
     async def check(
         self,
@@ -378,10 +488,44 @@ class SecurityManager:
         :return: True if permitted, False otherwise
         """
 
-        self._reload_rights()
+        return (
+            await self.check_many(
+                message,
+                [func],
+                user_id,
+                [inline_cmd],
+                usernames=usernames,
+            )
+        )[0]
 
-        if not (config := self.get_flags(func)):
-            return False
+    _check = check  # Legacy
+
+    async def check_many(
+        self,
+        message: typing.Optional[Message],
+        funcs: typing.Sequence[typing.Union[Command, int]],
+        user_id: typing.Optional[int] = None,
+        inline_cmds: typing.Optional[typing.Sequence[typing.Optional[str]]] = None,
+        *,
+        usernames: typing.Optional[typing.List[str]] = None,
+    ) -> typing.List[bool]:
+        """
+        Checks if message sender is permitted to execute each of functions.
+        Sender, its rules and rights in chat are resolved once for all of them
+
+        :param message: Message to check or None if you manually pass user_id
+        :param funcs: functions or flags
+        :param user_id: user ID
+        :param inline_cmds: Inline command names in the order of `funcs`
+            if it's inline query
+        :return: True or False for each function
+        """
+
+        self._sweep()
+
+        configs = [self.get_flags(func) for func in funcs]
+        if not any(configs):
+            return [False] * len(funcs)
 
         if not user_id:
             user_id = message.sender_id
@@ -394,25 +538,21 @@ class SecurityManager:
             and not message.is_group
             and message.edit_date
         ):
-            async for event in self._client.iter_admin_log(
-                utils.get_chat_id(message),
-                limit=10,
-                edit=True,
-            ):
-                if event.action.prev_message.id == message.id:
-                    user_id = event.user_id
-                    is_channel = True
+            if editor := await self._get_post_editor(message):
+                user_id = editor
+                is_channel = True
 
         if (
             user_id == self._client.tg_id
             or getattr(message, "out", False)
             and not is_channel
+            or user_id in self._owner
         ):
-            return True
+            return [bool(config) for config in configs]
 
-        logger.debug("Checking security match for %s", config)
+        logger.debug("Checking security match for %s", configs)
 
-        if config & SUDO or config & SUPPORT:
+        if any(config & SUDO or config & SUPPORT for config in configs):
             if not self._last_warning or time.time() - self._last_warning > 60 * 60:
                 import warnings
 
@@ -425,6 +565,127 @@ class SecurityManager:
                 )
                 self._last_warning = time.time()
 
+        if user_id in self._db.get(main.__name__, "blacklist_users", []):
+            return [False] * len(funcs)
+
+        if message is None:  # In case of checking inline query security map
+            inline_cmds = inline_cmds or [None] * len(funcs)
+            return [
+                bool(config)
+                and (
+                    self._check_tsec_inline(user_id, inline_cmd)
+                    or bool(config & EVERYONE)
+                )
+                for config, inline_cmd in zip(configs, inline_cmds)
+            ]
+
+        try:
+            chat = utils.get_chat_id(message)
+        except Exception:
+            chat = None
+
+        try:
+            cmd = message.raw_text[1:].split()[0].strip()
+            if usernames:
+                for username in usernames:
+                    cmd = cmd.replace(f"@{username}", "")
+        except Exception:
+            cmd = None
+
+        command_allowed = None
+        modules_allowed: typing.Dict[str, bool] = {}
+        # Flags -> whether sender's rights in chat match them
+        rights: typing.Dict[int, bool] = {}
+        permitted = []
+        for func, config in zip(funcs, configs):
+            if not config:
+                permitted.append(False)
+                continue
+
+            if callable(func):
+                module = func.__self__.__class__.__name__
+                if command_allowed is None:
+                    command_allowed = self._command_allowed(
+                        user_id,
+                        chat,
+                        self._client.loader.find_alias(cmd, include_legacytl=True)
+                        or cmd,
+                    )
+
+                if module not in modules_allowed:
+                    modules_allowed[module] = self._module_allowed(
+                        user_id,
+                        chat,
+                        module,
+                    )
+
+                if command_allowed or modules_allowed[module]:
+                    permitted.append(True)
+                    continue
+
+            if config not in rights:
+                rights[config] = await self._check_rights(message, user_id, config)
+
+            permitted.append(rights[config])
+
+        return permitted
+
+    def _command_allowed(
+        self,
+        user_id: int,
+        chat: typing.Optional[int],
+        command: typing.Optional[str],
+    ) -> bool:
+        if (user_id, "command", command) in self._sgroup_rules:
+            logger.debug("sgroup match for %s", command)
+            return True
+
+        if self._has_rule("user", user_id, "command", command):
+            logger.debug("tsec match for user %s", command)
+            return True
+
+        if chat and self._has_rule("chat", chat, "command", command):
+            logger.debug("tsec match for %s", command)
+            return True
+
+        return False
+
+    def _module_allowed(
+        self,
+        user_id: int,
+        chat: typing.Optional[int],
+        module: str,
+    ) -> bool:
+        if (user_id, "module", module) in self._sgroup_rules:
+            logger.debug("sgroup match for %s", module)
+            return True
+
+        if self._has_rule("user", user_id, "module", module):
+            logger.debug("tsec match for user %s", module)
+            return True
+
+        if chat and self._has_rule("chat", chat, "module", module):
+            logger.debug("tsec match for %s", module)
+            return True
+
+        return False
+
+    async def _check_rights(
+        self,
+        message: Message,
+        user_id: int,
+        config: int,
+    ) -> bool:
+        """
+        Checks if sender's rights in chat of message match flags.
+        Chat and participant are cached, so checks of the same sender
+        with different flags make at most one request
+
+        :param message: Message to check
+        :param user_id: user ID
+        :param config: security flags
+        :return: True if permitted, False otherwise
+        """
         f_group_owner = config & GROUP_OWNER
         f_group_admin_add_admins = config & GROUP_ADMIN_ADD_ADMINS
         f_group_admin_change_info = config & GROUP_ADMIN_CHANGE_INFO
@@ -446,99 +707,15 @@ class SecurityManager:
             or f_group_admin
         )
 
-        if user_id in self._owner:
-            return True
-
-        if user_id in self._db.get(main.__name__, "blacklist_users", []):
-            return False
-
-        if message is None:  # In case of checking inline query security map
-            return self._check_tsec_inline(user_id, inline_cmd) or bool(
-                config & EVERYONE
-            )
-
-        try:
-            chat = utils.get_chat_id(message)
-        except Exception:
-            chat = None
-
-        try:
-            cmd = message.raw_text[1:].split()[0].strip()
-            if usernames:
-                for username in usernames:
-                    cmd = cmd.replace(f"@{username}", "")
-        except Exception:
-            cmd = None
-
-        if callable(func):
-            command = self._client.loader.find_alias(cmd, include_legacytl=True) or cmd
-
-            for info in self._sgroups.copy().values():
-                if user_id in info.users:
-                    for permission in info.permissions:
-                        if (
-                            permission["rule_type"] == "command"
-                            and permission["rule"] == command
-                        ):
-                            logger.debug("sgroup match for %s", command)
-                            return True
-
-                        if (
-                            permission["rule_type"] == "module"
-                            and permission["rule"] == func.__self__.__class__.__name__
-                        ):
-                            logger.debug(
-                                "sgroup match for %s", func.__self__.__class__.__name__
-                            )
-                            return True
-
-            for info in self._tsec_user.copy():
-                if info["target"] == user_id:
-                    if info["rule_type"] == "command" and info["rule"] == command:
-                        logger.debug("tsec match for user %s", command)
-                        return True
-
-                    if (
-                        info["rule_type"] == "module"
-                        and info["rule"] == func.__self__.__class__.__name__
-                    ):
-                        logger.debug(
-                            "tsec match for user %s",
-                            func.__self__.__class__.__name__,
-                        )
-                        return True
-
-            if chat:
-                for info in self._tsec_chat.copy():
-                    if info["target"] == chat:
-                        if info["rule_type"] == "command" and info["rule"] == command:
-                            logger.debug("tsec match for %s", command)
-                            return True
-
-                        if (
-                            info["rule_type"] == "module"
-                            and info["rule"] == func.__self__.__class__.__name__
-                        ):
-                            logger.debug(
-                                "tsec match for %s",
-                                func.__self__.__class__.__name__,
-                            )
-                            return True
-
         if f_group_member and message.is_group or f_pm and message.is_private:
             return True
 
         if message.is_channel:
             if not message.is_group:
-                chat_id = utils.get_chat_id(message)
-                if (
-                    chat_id in self._cache
-                    and self._cache[chat_id]["exp"] >= time.time()
-                ):
-                    chat = self._cache[chat_id]["chat"]
-                else:
-                    chat = await message.get_chat()
-                    self._cache[chat_id] = {"chat": chat, "exp": time.time() + 5 * 60}
+                chat = await self._cache.get_or_fetch(
+                    ("chat", utils.get_chat_id(message)),
+                    message.get_chat,
+                )
 
                 if (
                     not chat.creator
@@ -551,22 +728,10 @@ class SecurityManager:
                 if self._any_admin and f_group_admin_any or f_group_admin:
                     return True
             elif f_group_admin_any or f_group_owner:
-                chat_id = utils.get_chat_id(message)
-                cache_obj = f"{chat_id}/{user_id}"
-                if (
-                    cache_obj in self._cache
-                    and self._cache[cache_obj]["exp"] >= time.time()
-                ):
-                    participant = self._cache[cache_obj]["user"]
-                else:
-                    participant = await message.client.get_permissions(
-                        message.peer_id,
-                        user_id,
-                    )
-                    self._cache[cache_obj] = {
-                        "user": participant,
-                        "exp": time.time() + 5 * 60,
-                    }
+                participant = await self._cache.get_or_fetch(
+                    ("participant", utils.get_chat_id(message), user_id),
+                    lambda: message.client.get_permissions(message.peer_id, user_id),
+                )
 
                 if (
                     participant.is_creator
@@ -593,32 +758,14 @@ class SecurityManager:
             return False
 
         if message.is_group and (f_group_admin_any or f_group_owner):
-            chat_id = utils.get_chat_id(message)
-            cache_obj = f"{chat_id}/{user_id}"
-
-            if (
-                cache_obj in self._cache
-                and self._cache[cache_obj]["exp"] >= time.time()
-            ):
-                participant = self._cache[cache_obj]["user"]
-            else:
-                full_chat = await message.client(GetFullChatRequest(message.chat_id))
-                participants = full_chat.full_chat.participants.participants
-                participant = next(
-                    (
-                        possible_participant
-                        for possible_participant in participants
-                        if possible_participant.user_id == message.sender_id
-                    ),
-                    None,
-                )
-                self._cache[cache_obj] = {
-                    "user": participant,
-                    "exp": time.time() + 5 * 60,
-                }
+            participants = await self._cache.get_or_fetch(
+                ("participants", utils.get_chat_id(message)),
+                lambda: self._get_chat_participants(message.chat_id),
+            )
+            participant = participants.get(user_id)
 
             if not participant:
-                return
+                return False
 
             if (
                 isinstance(participant, ChatParticipantCreator)
@@ -629,4 +776,69 @@ class SecurityManager:
 
         return False
 
-    _check = check  # Legacy
+    async def _get_post_editor(self, message: Message) -> typing.Optional[int]:
+        """
+        Get the user, who edited channel post. Lookups of posts in the same channel,
+        made at the same time, share a single admin log request
+        :param message: Edited channel post
+        :return: User ID or None if edit is not found in admin log
+        """
+        chat_id = utils.get_chat_id(message)
+        key = (chat_id, message.id)
+        if (editor := self._editors.get(key)) is None or editor[0] != message.edit_date:
+            if (batch := self._editor_batches.get(chat_id)) is None:
+                batch = self._editor_batches[chat_id] = (
+                    asyncio.ensure_future(self._fetch_editors(chat_id)),
+                    set(),
+                )
+
+            batch[1].add(message.id)
+            await asyncio.shield(batch[0])
+            editor = self._editors.get(key)
+
+        return editor[1] if editor and editor[0] == message.edit_date else None
+
+    async def _fetch_editors(self, chat_id: int):
+        """
+        Cache editors of all edits on the admin log page
+        :param chat_id: Channel ID
+        """
+        # Let lookups of simultaneous edits join the batch
+        await asyncio.sleep(_ADMIN_LOG_BATCH_DELAY)
+        _, ids = self._editor_batches.pop(chat_id)
+
+        seen = set()
+        async for event in self._client.iter_admin_log(
+            chat_id,
+            limit=min(max(10, len(ids)), 100),
+            edit=True,
+        ):
+            message_id = event.action.prev_message.id
+            # Admin log is ordered from the newest event
+            if message_id not in seen:
+                seen.add(message_id)
+                self._editors.set(
+                    (chat_id, message_id),
+                    (
+                        getattr(event.action.new_message, "edit_date", None),
+                        event.user_id,
+                    ),
+                )
+
+    async def _get_chat_participants(
+        self, chat_id: int
+    ) -> typing.Dict[int, typing.Any]:
+        """
+        Get all participants of basic group with a single request
+        :param chat_id: Chat ID
+        :return: Participants by user ID
+        """
+        full_chat = await self._client(GetFullChatRequest(chat_id))
+        return {
+            participant.user_id: participant
+            for participant in getattr(
+                full_chat.full_chat.participants,
+                "participants",
+                [],
+            )
+        }
@@ -0,0 +1,47 @@
+"""Persistence engines for `Database`"""
+
+import logging
+from pathlib import Path
+
+from .base import StorageEngine, atomic_write
+from .journal import JournalStorage
+from .jsonfile import JSONStorage
+from .sharded import ShardedStorage
+from .sqlite import SQLiteStorage
+
+__all__ = [
+    "StorageEngine",
+    "JSONStorage",
+    "JournalStorage",
+    "SQLiteStorage",
+    "ShardedStorage",
+    "atomic_write",
+    "get_engine",
+]
+
+logger = logging.getLogger(__name__)
+
+ENGINES = {
+    engine.name: engine
+    for engine in (JSONStorage, JournalStorage, SQLiteStorage, ShardedStorage)
+}
+DEFAULT_ENGINE = JSONStorage.name
+
+
+def get_engine(name: str, base_path: Path, tg_id: int) -> StorageEngine:
+    """
+    Get storage engine by its name
+    :param name: Engine name, falls back to default one if unknown
+    :param base_path: Directory with databases
+    :param tg_id: Telegram ID of account, which database belongs to
+    :return: Storage engine instance
+    """
+    if name not in ENGINES:
+        logger.warning(
+            "Unknown database engine %s, falling back to %s",
+            name,
+            DEFAULT_ENGINE,
+        )
+        name = DEFAULT_ENGINE
+
+    return ENGINES[name](base_path, tg_id)
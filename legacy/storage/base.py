@@ -0,0 +1,111 @@
+"""Base class for database storage engines"""
+
+import logging
+import os
+import threading
+import typing
+from pathlib import Path
+
+import ujson
+
+logger = logging.getLogger(__name__)
+
+
+def atomic_write(path: Path, data: str):
+    """
+    Atomically replace file contents, so the crash in the middle
+    of the write never leaves truncated file behind
+    :param path: Path to file
+    :param data: New contents
+    """
+    tmp = path.with_name(f"{path.name}.tmp")
+
+    with open(tmp, "w") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+    os.replace(tmp, path)
+
+
+class StorageEngine:
+    """
+    Persists the contents of `Database`
+    Engine is used in two steps: `prepare` is called on the event loop with
+    consistent view of the database and serializes pending changes, then
+    `commit` writes serialized payloads to disk in worker thread
+    """
+
+    name: str = ""
+    # Lazy engines don't read the whole database on start,
+    # owners are loaded with `load_owner` on first access
+    lazy: bool = False
+
+    def __init__(self, base_path: Path, tg_id: int):
+        self._base_path = base_path
+        self._tg_id = tg_id
+        self._db_file = base_path / f"config-{tg_id}.json"
+        self._lock = threading.Lock()
+
+    def _read_snapshot(self) -> dict:
+        """Read monolithic JSON file, which is the default database layout"""
+        try:
+            return ujson.loads(self._db_file.read_text())
+        except ValueError:
+            logger.warning("Database read failed! Creating new one...")
+        except FileNotFoundError:
+            logger.debug("Database file not found, creating new one...")
+
+        return {}
+
+    def _dump_snapshot(self, data: dict) -> str:
+        return ujson.dumps(data, indent=4)
+
+    def load(self) -> dict:
+        """
+        Read database from disk
+        :return: Database contents
+        """
+        raise NotImplementedError
+
+    def owners(self) -> typing.Iterable[str]:
+        """
+        List owners, stored on disk. Used by lazy engines only
+        :return: Owner names
+        """
+        raise NotImplementedError
+
+    def load_owner(self, owner: str) -> dict:
+        """
+        Read keys of single owner. Used by lazy engines only
+        :param owner: Owner name
+        :return: Owner keys
+        """
+        raise NotImplementedError
+
+    def prepare(
+        self,
+        data: dict,
+        changes: typing.Optional[typing.Set[typing.Tuple[str, str]]],
+        unloaded: typing.AbstractSet[str] = frozenset(),
+    ) -> typing.Any:
+        """
+        Serialize pending changes. Called from the event loop
+        :param data: Database contents
+        :param changes: Set of changed `(owner, key)` pairs or `None` if the
+            whole database must be written
+        :param unloaded: Owners, which are stored on disk, but were not loaded
+            by lazy engine yet. They must be kept on full write
+        :return: Payload, which will be passed to `commit`
+        """
+        raise NotImplementedError
+
+    def commit(self, payloads: typing.List[typing.Any]):
+        """
+        Write payloads to disk in order they were prepared. Thread-safe
+        :param payloads: Payloads, returned by `prepare`
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """Release resources, held by engine"""
@@ -0,0 +1,297 @@
+"""Offline benchmark of `Database` and storage engines
+
+Usage: python -m legacy.storage.benchmark [--engine json sqlite] [--profile small]
+    [--iterations 200] [--output results.json]
+"""
+
+import argparse
+import asyncio
+import json
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+import typing
+from pathlib import Path
+
+import ujson
+
+# Rough shapes of real databases: number of owners, keys per owner
+# and length of list values
+PROFILES = {
+    "small": (20, 10, 5),  # ~10 KB
+    "medium": (200, 20, 50),  # ~1 MB
+    "large": (1000, 50, 200),  # ~50 MB
+}
+DEFAULT_PROFILES = ("small", "medium")
+DEFAULT_ITERATIONS = 200
+
+
+class StubClient:
+    """Stands in for `CustomTelegramClient`, which `Database` needs only for its ID"""
+
+    tg_id = 0
+
+
+def build_data(profile: str, seed: int = 0) -> dict:
+    """
+    Generate database contents of given shape
+    :param profile: Name of profile from `PROFILES`
+    :param seed: Random seed, so the same data is generated on each run
+    :return: Database contents
+    """
+    owners, keys, list_size = PROFILES[profile]
+    rnd = random.Random(seed)
+    data = {}
+    for owner in range(owners):
+        values = {}
+        for key in range(keys):
+            kind = key % 4
+            if kind == 0:
+                value = rnd.randint(0, 2**31)
+            elif kind == 1:
+                value = "".join(rnd.choices("abcdefghijklmnopqrstuvwxyz", k=32))
+            elif kind == 2:
+                value = [rnd.randint(0, 2**31) for _ in range(list_size)]
+            else:
+                value = {
+                    str(i): {"target": rnd.randint(0, 2**31), "rule": f"command/{i}"}
+                    for i in range(list_size // 5 + 1)
+                }
+
+            values[f"key{key}"] = value
+
+        data[f"Owner{owner}"] = values
+
+    return data
+
+
+def measure(
+    func: typing.Callable[[], typing.Any],
+    iterations: int,
+    setup: typing.Optional[typing.Callable[[], typing.Any]] = None,
+) -> dict:
+    """
+    Call `func` repeatedly and collect its latency
+    :param func: Function to measure
+    :param iterations: Number of calls
+    :param setup: Function, called before each call and not measured
+    :return: Latency statistics in microseconds and throughput
+    """
+    timings = []
+    for _ in range(iterations):
+        if setup is not None:
+            setup()
+
+        start = time.perf_counter_ns()
+        func()
+        timings.append(time.perf_counter_ns() - start)
+
+    return summarize(timings)
+
+
+def summarize(timings: typing.List[int]) -> dict:
+    """
+    Compute statistics of measured calls
+    :param timings: Duration of each call in nanoseconds
+    :return: Latency statistics in microseconds and throughput
+    """
+    iterations = len(timings)
+    timings = sorted(timings)
+    total = sum(timings) or 1
+    return {
+        "n": iterations,
+        "p50_us": timings[len(timings) // 2] / 1000,
+        "p99_us": timings[min(len(timings) - 1, len(timings) * 99 // 100)] / 1000,
+        "mean_us": statistics.mean(timings) / 1000,
+        "ops_per_sec": iterations * 1e9 / total,
+    }
+
+
+def run_engine(
+    engine: str,
+    profile: str,
+    iterations: int,
+    base_path: Path,
+) -> typing.List[dict]:
+    """
+    Run all scenarios for engine and profile
+    :param engine: Storage engine name
+    :param profile: Name of profile from `PROFILES`
+    :param iterations: Number of calls in each scenario
+    :param base_path: Directory to keep database files in
+    :return: Scenario results
+    """
+    from .. import database
+    from . import get_engine
+
+    def open_db() -> database.Database:
+        db = database.Database(StubClient())
+        db._engine = get_engine(engine, base_path, StubClient.tg_id)
+        # Writes are coalesced by flusher, which never gets a chance to run
+        # here, so only explicit flushes hit the disk
+        db._flush_interval = 3600
+        db.read()
+        return db
+
+    data = build_data(profile)
+    db = open_db()
+    db.update(ujson.loads(ujson.dumps(data)))
+    db.save()
+    db.flush()
+
+    rnd = random.Random(1)
+    owners = list(data)
+    keys = list(data[owners[0]])
+    pointer_list = db.pointer(owners[0], "key2", [])
+    pointer_dict = db.pointer(owners[0], "key3", {})
+    counter = iter(range(10**9))
+
+    def random_key() -> typing.Tuple[str, str]:
+        return rnd.choice(owners), rnd.choice(keys)
+
+    def set_value():
+        db.set(*random_key(), next(counter))
+
+    def set_and_flush():
+        set_value()
+        db.flush()
+
+    def full_save():
+        db.save()
+        db.flush()
+
+    def new_revision():
+        db._next_revision_call = 0
+        for _ in range(10):
+            set_value()
+
+    cold = []
+
+    def cold_read():
+        cold.append(open_db())
+
+    def cold_read_all():
+        cold.append(open_db())
+        cold[-1].load_all()
+
+    scenarios = {
+        "get": lambda: db.get(*random_key()),
+        "set": set_value,
+        "set_flush": set_and_flush,
+        "pointer_list_append": lambda: pointer_list.append(next(counter)),
+        "pointer_dict_setitem": lambda: pointer_dict.__setitem__(
+            str(next(counter) % 100), 1
+        ),
+        "save": full_save,
+        "read": cold_read,
+        "read_all": cold_read_all,
+    }
+
+    size = len(ujson.dumps(data))
+    results = []
+    for scenario, func in scenarios.items():
+        # Full writes and cold reads of large databases take seconds
+        n = (
+            iterations
+            if scenario not in {"save", "read", "read_all"}
+            else max(1, iterations // 20)
+        )
+        results.append(
+            {
+                "engine": engine,
+                "profile": profile,
+                "size": size,
+                "scenario": scenario,
+                **measure(func, n),
+            }
+        )
+        db.flush()
+        for cold_db in cold:
+            cold_db._engine.close()
+
+        cold.clear()
+
+    results.append(
+        {
+            "engine": engine,
+            "profile": profile,
+            "size": size,
+            "scenario": "rollback",
+            **measure(
+                db.rollback, min(iterations, database.REVISIONS_LIMIT), new_revision
+            ),
+        }
+    )
+    db.flush()
+
+    if db._saving_task:
+        db._saving_task.cancel()
+
+    db._engine.close()
+    return results
+
+
+async def run(
+    engines: typing.Iterable[str],
+    profiles: typing.Iterable[str],
+    iterations: int,
+) -> dict:
+    results = []
+    for engine in engines:
+        for profile in profiles:
+            with tempfile.TemporaryDirectory() as base_path:
+                results += run_engine(engine, profile, iterations, Path(base_path))
+                # Let cancelled flushers finish
+                await asyncio.sleep(0)
+
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "iterations": iterations,
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--engine", nargs="+", dest="engines", default=None)
+    parser.add_argument(
+        "--profile",
+        nargs="+",
+        dest="profiles",
+        choices=PROFILES,
+        default=DEFAULT_PROFILES,
+    )
+    parser.add_argument("--iterations", type=int, default=DEFAULT_ITERATIONS)
+    parser.add_argument("--output", type=Path, help="Write JSON results to file")
+    arguments = parser.parse_args()
+
+    # `main` parses command line on import
+    sys.argv = sys.argv[:1]
+    from .. import main as _  # noqa: F401
+    from . import ENGINES
+
+    report = asyncio.run(
+        run(
+            arguments.engines or list(ENGINES), arguments.profiles, arguments.iterations
+        )
+    )
+
+    for result in report["results"]:
+        print(
+            "{engine:>8} {profile:>7} {scenario:>21} p50 {p50_us:>11.1f}us"
+            " p99 {p99_us:>11.1f}us {ops_per_sec:>11.1f} op/s".format(**result),
+            file=sys.stderr,
+        )
+
+    if arguments.output:
+        arguments.output.write_text(json.dumps(report, indent=4))
+    else:
+        print(json.dumps(report, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+"""Append-only journal engine"""
+
+import logging
+import os
+import threading
+import typing
+from pathlib import Path
+
+import ujson
+
+from .base import StorageEngine, atomic_write
+
+logger = logging.getLogger(__name__)
+
+# Journal is merged into snapshot once it grows larger than this
+JOURNAL_LIMIT = 4 * 1024 * 1024  # 4 MB
+
+SNAPSHOT = 0
+RECORDS = 1
+
+
+def journal_path(db_file: Path) -> Path:
+    """
+    Get path to journal of database file
+    :param db_file: Path to database snapshot
+    :return: Path to journal
+    """
+    return db_file.with_suffix(".journal")
+
+
+def replay_journal(data: dict, path: Path) -> bool:
+    """
+    Apply change records from journal to database contents
+    Record is either `[owner, key, value]` or `[owner, key]` if the key was removed
+    :param data: Database contents, will be modified in-place
+    :param path: Path to journal
+    :return: `False` if journal has broken record, which means that the last
+        write was interrupted. All records after broken one are skipped
+    """
+    with open(path) as f:
+        for line in f:
+            try:
+                record = ujson.loads(line)
+            except ValueError:
+                logger.warning(
+                    "Journal %s contains broken record, ignoring the rest of it",
+                    path,
+                )
+                return False
+
+            if len(record) == 3:
+                owner, key, value = record
+                data.setdefault(owner, {})[key] = value
+            else:
+                owner, key = record
+                data.get(owner, {}).pop(key, None)
+
+    return True
+
+
+class JournalStorage(StorageEngine):
+    """
+    Appends changed keys to `config-<id>.journal` instead of rewriting
+    the whole database, so the cost of write depends only on the size of change.
+    Journal is merged into `config-<id>.json` snapshot in worker thread
+    once it grows larger than `JOURNAL_LIMIT`
+    """
+
+    name = "journal"
+
+    def __init__(self, base_path: Path, tg_id: int, limit: int = JOURNAL_LIMIT):
+        super().__init__(base_path, tg_id)
+        self._journal_file = journal_path(self._db_file)
+        self._limit = limit
+        self._compaction: typing.Optional[threading.Thread] = None
+
+    def _write_snapshot(self, snapshot: str):
+        atomic_write(self._db_file, snapshot)
+        self._journal_file.unlink(missing_ok=True)
+
+    def load(self) -> dict:
+        data = self._read_snapshot()
+
+        if self._journal_file.exists() and not replay_journal(
+            data,
+            self._journal_file,
+        ):
+            # Records, appended after the broken one, would be lost on the next
+            # start, so the journal is merged right away
+            self._write_snapshot(self._dump_snapshot(data))
+
+        return data
+
+    def prepare(
+        self,
+        data: dict,
+        changes: typing.Optional[typing.Set[typing.Tuple[str, str]]],
+        unloaded: typing.AbstractSet[str] = frozenset(),
+    ) -> typing.Tuple[int, str]:
+        if changes is None:
+            return SNAPSHOT, self._dump_snapshot(data)
+
+        return RECORDS, "".join(
+            ujson.dumps(
+                [owner, key, data[owner][key]]
+                if owner in data and key in data[owner]
+                else [owner, key]
+            )
+            + "\n"
+            for owner, key in changes
+        )
+
+    def commit(self, payloads: typing.List[typing.Tuple[int, str]]):
+        snapshot = None
+        records = []
+        for kind, payload in payloads:
+            if kind == SNAPSHOT:
+                snapshot, records = payload, []
+            elif payload:
+                records.append(payload)
+
+        with self._lock:
+            if snapshot is not None:
+                self._write_snapshot(snapshot)
+
+            if records:
+                with open(self._journal_file, "a") as f:
+                    f.write("".join(records))
+                    f.flush()
+                    os.fsync(f.fileno())
+
+        self._maybe_compact()
+
+    def _maybe_compact(self):
+        if self._compaction and self._compaction.is_alive():
+            return
+
+        try:
+            if self._journal_file.stat().st_size < self._limit:
+                return
+        except FileNotFoundError:
+            return
+
+        self._compaction = threading.Thread(
+            target=self.compact,
+            name=f"legacy-db-compaction-{self._tg_id}",
+            daemon=True,
+        )
+        self._compaction.start()
+
+    def compact(self):
+        """
+        Merge journal into snapshot
+        Replay is made from files on disk, so it doesn't touch the live database
+        """
+        try:
+            with self._lock:
+                try:
+                    data = ujson.loads(self._db_file.read_text())
+                except FileNotFoundError:
+                    data = {}
+
+                if self._journal_file.exists():
+                    replay_journal(data, self._journal_file)
+
+                self._write_snapshot(self._dump_snapshot(data))
+        except Exception:
+            logger.exception("Database journal compaction failed!")
+            return
+
+        logger.debug("Compacted database journal of %s", self._tg_id)
+
+    def close(self):
+        if self._compaction:
+            self._compaction.join()
@@ -0,0 +1,39 @@
+"""Monolithic JSON file engine"""
+
+import typing
+from pathlib import Path
+
+from .base import StorageEngine, atomic_write
+from .journal import journal_path, replay_journal
+
+
+class JSONStorage(StorageEngine):
+    """Keeps the whole database in `config-<id>.json` and rewrites it on save"""
+
+    name = "json"
+
+    def __init__(self, base_path: Path, tg_id: int):
+        super().__init__(base_path, tg_id)
+        self._journal_file = journal_path(self._db_file)
+
+    def load(self) -> dict:
+        data = self._read_snapshot()
+
+        # Changes might be left in journal after switching from `JournalStorage`
+        if self._journal_file.exists():
+            replay_journal(data, self._journal_file)
+
+        return data
+
+    def prepare(
+        self,
+        data: dict,
+        changes: typing.Optional[typing.Set[typing.Tuple[str, str]]],
+        unloaded: typing.AbstractSet[str] = frozenset(),
+    ) -> str:
+        return self._dump_snapshot(data)
+
+    def commit(self, payloads: typing.List[str]):
+        with self._lock:
+            atomic_write(self._db_file, payloads[-1])
+            self._journal_file.unlink(missing_ok=True)
@@ -0,0 +1,151 @@
+"""Engine with one JSON file per database owner"""
+
+import logging
+import os
+import shutil
+import typing
+from pathlib import Path
+from urllib.parse import quote, unquote
+
+import ujson
+
+from .base import StorageEngine, atomic_write
+from .jsonfile import JSONStorage
+
+logger = logging.getLogger(__name__)
+
+SHARD_SUFFIX = ".json"
+
+
+def shards_path(base_path: Path, tg_id: int) -> Path:
+    """
+    Get directory with database shards of account
+    :param base_path: Directory with databases
+    :param tg_id: Telegram ID of account
+    :return: Path to shards directory
+    """
+    return base_path / f"config-{tg_id}"
+
+
+def convert(base_path: Path, tg_id: int) -> int:
+    """
+    Split monolithic `config-<id>.json` into per-owner shards. Shards are
+    written to temporary directory first, so interrupted conversion is
+    restarted from scratch on the next start. Source file is left in place
+    :param base_path: Directory with databases
+    :param tg_id: Telegram ID of account
+    :return: Number of converted owners
+    """
+    target = shards_path(base_path, tg_id)
+    tmp = target.with_name(f"{target.name}.tmp")
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir(parents=True)
+
+    data = JSONStorage(base_path, tg_id).load()
+    for owner, values in data.items():
+        if isinstance(values, dict):
+            atomic_write(ShardedStorage.shard_file(tmp, owner), ujson.dumps(values))
+
+    os.replace(tmp, target)
+    return len(data)
+
+
+class ShardedStorage(StorageEngine):
+    """
+    Keeps each owner in its own file inside of `config-<id>` directory.
+    Owners are read on first access and only shards of changed owners are
+    rewritten. Existing `config-<id>.json` is converted on the first start
+    """
+
+    name = "sharded"
+    lazy = True
+
+    def __init__(self, base_path: Path, tg_id: int):
+        super().__init__(base_path, tg_id)
+        self._shards_dir = shards_path(base_path, tg_id)
+
+    @staticmethod
+    def shard_file(directory: Path, owner: str) -> Path:
+        # Owners are arbitrary strings, so they are escaped to be safe filenames
+        return directory / f"{quote(owner, safe='')}{SHARD_SUFFIX}"
+
+    def _shard(self, owner: str) -> Path:
+        return self.shard_file(self._shards_dir, owner)
+
+    def load(self) -> dict:
+        with self._lock:
+            if not self._shards_dir.is_dir():
+                if count := convert(self._base_path, self._tg_id):
+                    logger.info(
+                        "Converted %s owners from %s into %s",
+                        count,
+                        self._db_file.name,
+                        self._shards_dir.name,
+                    )
+
+        return {}
+
+    def _owners_on_disk(self) -> typing.List[str]:
+        return [
+            unquote(shard.name[: -len(SHARD_SUFFIX)])
+            for shard in self._shards_dir.glob(f"*{SHARD_SUFFIX}")
+        ]
+
+    def owners(self) -> typing.Iterable[str]:
+        with self._lock:
+            return self._owners_on_disk()
+
+    def load_owner(self, owner: str) -> dict:
+        try:
+            with self._lock:
+                return ujson.loads(self._shard(owner).read_text())
+        except ValueError:
+            logger.warning("Database shard of %s is broken, resetting it", owner)
+        except FileNotFoundError:
+            pass
+
+        return {}
+
+    def prepare(
+        self,
+        data: dict,
+        changes: typing.Optional[typing.Set[typing.Tuple[str, str]]],
+        unloaded: typing.AbstractSet[str] = frozenset(),
+    ) -> tuple:
+        owners = data.keys() if changes is None else {owner for owner, _ in changes}
+        shards = {
+            owner: ujson.dumps(data[owner]) if owner in data else None
+            for owner in owners
+        }
+
+        # Owners to keep on full write. Shards of the rest are removed
+        return shards, (
+            frozenset(data.keys()) | frozenset(unloaded) if changes is None else None
+        )
+
+    def commit(self, payloads: typing.List[tuple]):
+        with self._lock:
+            self._shards_dir.mkdir(parents=True, exist_ok=True)
+
+            # Only the latest state of each shard is written
+            result: typing.Dict[str, typing.Optional[str]] = {}
+            for shards, keep in payloads:
+                if keep is not None:
+                    result.update(
+                        dict.fromkeys(
+                            (
+                                owner
+                                for owner in {*self._owners_on_disk(), *result}
+                                if owner not in keep
+                            ),
+                            None,
+                        )
+                    )
+
+                result.update(shards)
+
+            for owner, shard in result.items():
+                if shard is None:
+                    self._shard(owner).unlink(missing_ok=True)
+                else:
+                    atomic_write(self._shard(owner), shard)
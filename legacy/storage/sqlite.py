@@ -0,0 +1,159 @@
+"""SQLite engine with one row per database key"""
+
+import logging
+import sqlite3
+import typing
+from pathlib import Path
+
+import ujson
+
+from .base import StorageEngine
+from .jsonfile import JSONStorage
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT = 0
+RECORDS = 1
+
+
+class SQLiteStorage(StorageEngine):
+    """
+    Keeps each `(owner, key)` pair as a separate row of `config-<id>.db`,
+    so the write costs as much as the changed value. Owners are read on first
+    access. Existing `config-<id>.json` is imported on the first start
+    """
+
+    name = "sqlite"
+    lazy = True
+
+    def __init__(self, base_path: Path, tg_id: int):
+        super().__init__(base_path, tg_id)
+        self._sqlite_file = base_path / f"config-{tg_id}.db"
+        self._conn = sqlite3.connect(
+            str(self._sqlite_file),
+            check_same_thread=False,
+            isolation_level=None,
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS data (owner TEXT NOT NULL, key TEXT NOT"
+            " NULL, value TEXT NOT NULL, PRIMARY KEY (owner, key)) WITHOUT ROWID"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)"
+        )
+
+    def _migrate(self):
+        """Import monolithic JSON database, if it wasn't imported yet"""
+        if self._conn.execute("SELECT 1 FROM meta WHERE name = 'migrated'").fetchone():
+            return
+
+        data = JSONStorage(self._base_path, self._tg_id).load()
+
+        with self._conn:
+            self._conn.execute("BEGIN")
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO data VALUES (?, ?, ?)",
+                (
+                    (str(owner), str(key), ujson.dumps(value))
+                    for owner, values in data.items()
+                    if isinstance(values, dict)
+                    for key, value in values.items()
+                ),
+            )
+            self._conn.execute("INSERT INTO meta VALUES ('migrated', '1')")
+
+        if data:
+            logger.info(
+                "Imported %s owners from %s into %s",
+                len(data),
+                self._db_file.name,
+                self._sqlite_file.name,
+            )
+
+    def load(self) -> dict:
+        with self._lock:
+            self._migrate()
+
+        return {}
+
+    def owners(self) -> typing.Iterable[str]:
+        with self._lock:
+            return [
+                row[0] for row in self._conn.execute("SELECT DISTINCT owner FROM data")
+            ]
+
+    def load_owner(self, owner: str) -> dict:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key, value FROM data WHERE owner = ?",
+                (owner,),
+            ).fetchall()
+
+        return {key: ujson.loads(value) for key, value in rows}
+
+    def prepare(
+        self,
+        data: dict,
+        changes: typing.Optional[typing.Set[typing.Tuple[str, str]]],
+        unloaded: typing.AbstractSet[str] = frozenset(),
+    ) -> tuple:
+        if changes is None:
+            return (
+                SNAPSHOT,
+                [
+                    (str(owner), str(key), ujson.dumps(value))
+                    for owner, values in data.items()
+                    for key, value in values.items()
+                ],
+                frozenset(unloaded),
+            )
+
+        return (
+            RECORDS,
+            [
+                (
+                    str(owner),
+                    str(key),
+                    (
+                        ujson.dumps(data[owner][key])
+                        if owner in data and key in data[owner]
+                        else None
+                    ),
+                )
+                for owner, key in changes
+            ],
+            None,
+        )
+
+    def commit(self, payloads: typing.List[tuple]):
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN")
+            for kind, rows, unloaded in payloads:
+                if kind == SNAPSHOT:
+                    # Everything except owners, which were never loaded,
+                    # is replaced with the contents of snapshot
+                    self._conn.executemany(
+                        "DELETE FROM data WHERE owner = ?",
+                        [
+                            (owner,)
+                            for (owner,) in self._conn.execute(
+                                "SELECT DISTINCT owner FROM data"
+                            ).fetchall()
+                            if owner not in unloaded
+                        ],
+                    )
+
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO data VALUES (?, ?, ?)",
+                    [row for row in rows if row[2] is not None],
+                )
+                self._conn.executemany(
+                    "DELETE FROM data WHERE owner = ? AND key = ?",
+                    [row[:2] for row in rows if row[2] is None],
+                )
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -113,6 +113,12 @@ class Translator(BaseTranslator):
         self.db = db
         self._data = {}
         self.raw_data = {}
+        self.languages: typing.Tuple[str, ...] = ()
+        self._update_languages()
+        db.subscribe(__name__, "lang", self._update_languages)
+
+    def _update_languages(self, *_):
+        self.languages = tuple(self.db.get(__name__, "lang", "en").split(" "))
 
     async def init(self) -> bool:
         self._data = self._get_pack_content(PACKS / "en.yml")
@@ -201,11 +207,7 @@ class Strings:
                     next(
                         (
                             f"strings_{lang}"
-                            for lang in self._translator.db.get(
-                                __name__,
-                                "lang",
-                                "en",
-                            ).split(" ")
+                            for lang in self._translator.languages
                             if hasattr(self._mod, f"strings_{lang}")
                             and isinstance(getattr(self._mod, f"strings_{lang}"), dict)
                             and key in getattr(self._mod, f"strings_{lang}")
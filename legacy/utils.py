@@ -66,6 +66,7 @@ from legacytl.tl.functions.messages import (
     SetHistoryTTLRequest,
     UpdateDialogFilterRequest,
 )
+from legacytl.tl.tlobject import TLObject
 from legacytl.tl.types import (
     Channel,
     Chat,
@@ -361,7 +362,8 @@ def censor(
     replace_with: str = "redacted_{count}_chars",
 ):
     """
-    May modify the original object, but don't rely on it
+    May modify the original object, but don't rely on it.
+    Walks the whole object, so prefer `redact` for output, which may leak data
     :param obj: Object to censor, preferrably legacytl
     :param to_censor: Iterable of strings to censor
     :param replace_with: String to replace with, {count} will be replaced with the number of characters
@@ -379,6 +381,39 @@ def censor(
     return obj
 
 
+def redact(
+    obj: typing.Any,
+    to_redact: typing.Collection[str] = frozenset({"phone"}),
+    replace_with: str = "redacted_{count}_chars",
+) -> typing.Any:
+    """
+    Get redacted copy of object, leaving the original intact. Supposed to be
+    called right before object is shown or logged, so events are not walked
+    on dispatch
+    :param obj: Object to redact. Legacytl objects are converted to dicts
+    :param to_redact: Names of fields to redact
+    :param replace_with: String to replace with, {count} will be replaced with the number of characters
+    :return: Redacted copy, which can be passed to `TLObject.pretty_format`
+    """
+    if isinstance(obj, TLObject):
+        obj = obj.to_dict()
+
+    if isinstance(obj, dict):
+        return {
+            k: (
+                replace_with.format(count=len(str(v)))
+                if k in to_redact and v
+                else redact(v, to_redact, replace_with)
+            )
+            for k, v in obj.items()
+        }
+
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(redact(v, to_redact, replace_with) for v in obj)
+
+    return obj
+
+
 def relocate_entities(
     entities: typing.List[FormattingEntity],
     offset: int,
@@ -536,9 +571,14 @@ async def answer(
     )
 
     if isinstance(response, str) and not kwargs.pop("asfile", False):
+        if grep := getattr(message, "legacy_grep", None):
+            # Output is filtered before it's parsed and split into parts
+            response = grep(response)
+            kwargs["grepped"] = True
+
         text, entities = parse_mode.parse(response)
 
-        if len(text) >= 4096 and not hasattr(message, "legacy_grepped"):
+        if len(text) >= 4096:
             try:
                 if not message.client.loader.inline.init_complete:
                     raise
@@ -0,0 +1,32 @@
+"""Common fixtures of tests"""
+
+import sys
+import typing
+from pathlib import Path
+
+import pytest
+
+# `legacy.main` parses command line arguments on import and must be imported
+# before other core modules, which import each other
+sys.argv = sys.argv[:1]
+
+from legacy import main, storage  # noqa: E402,F401
+from legacy.database import Database  # noqa: E402
+from legacy.benchmarks.dispatcher import StubClient  # noqa: E402
+
+
+@pytest.fixture
+def make_db(tmp_path: Path) -> typing.Callable[[str], Database]:
+    def make(engine: str = "json") -> Database:
+        client = StubClient()
+        database = Database(client)
+        database._engine = storage.get_engine(engine, tmp_path, client.tg_id)
+        database.read()
+        return database
+
+    return make
+
+
+@pytest.fixture
+def db(make_db: typing.Callable[[str], Database]) -> Database:
+    return make_db()
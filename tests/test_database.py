@@ -0,0 +1,83 @@
+"""Tests of database revisions"""
+
+from legacy.database import Database
+
+
+def _new_revision(db: Database):
+    db._next_revision_call = 0
+
+
+def test_rollback_of_value_mutated_in_place(db: Database):
+    db.set("Module", "items", [1])
+    _new_revision(db)
+
+    items = db.get("Module", "items")
+    items.append(2)
+    db.set("Module", "items", items)
+    assert db.get("Module", "items") == [1, 2]
+
+    assert db.rollback(1)
+    assert db.get("Module", "items") == [1]
+
+
+def test_rollback_after_several_in_place_mutations(db: Database):
+    db.set("Module", "config", {"a": 1})
+    _new_revision(db)
+
+    config = db.get("Module", "config")
+    config["a"] = 2
+    db.set("Module", "config", config)
+    _new_revision(db)
+
+    config["a"] = 3
+    db.set("Module", "config", config)
+
+    assert db.rollback(1)
+    assert db.get("Module", "config") == {"a": 2}
+    assert db.rollback(1)
+    assert db.get("Module", "config") == {"a": 1}
+
+
+def test_failed_transaction_leaves_no_revisions(db: Database):
+    db.set("Module", "foo", 1)
+    _new_revision(db)
+    db.set("Module", "bar", 1)
+
+    try:
+        with db.transaction():
+            db.set("Module", "bar", 2)
+            db.set("Module", "baz", 2)
+            _new_revision(db)
+            db.set("Module", "foo", 2)
+            raise ValueError
+    except ValueError:
+        pass
+
+    assert db["Module"] == {"foo": 1, "bar": 1}
+    assert len(db._revisions) == 2
+
+    assert db.rollback(1)
+    assert db["Module"] == {"foo": 1}
+
+
+def test_views_include_owners_not_loaded_yet(make_db):
+    db = make_db("sqlite")
+    db.set("First", "key", 1)
+    db.set("Second", "key", 2)
+    db.flush()
+
+    db = make_db("sqlite")
+    assert len(db) == 2
+    assert set(db._unloaded) == {"First", "Second"}
+
+    db.set("First", "key", 3)
+    db.flush()
+    assert db._unloaded == {"Second"}
+    assert len(db) == 2
+
+    assert sorted(db) == ["First", "Second"]
+    assert not db._unloaded
+    assert dict(db.items()) == {"First": {"key": 3}, "Second": {"key": 2}}
+
+    db = make_db("sqlite")
+    assert dict(db.items()) == {"First": {"key": 3}, "Second": {"key": 2}}
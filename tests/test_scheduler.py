@@ -0,0 +1,36 @@
+"""Tests of handler scheduler"""
+
+import asyncio
+
+from legacy import scheduler
+
+
+def test_watchers_leave_module_slots_for_commands():
+    async def run():
+        sched = scheduler.Scheduler()
+        release = asyncio.Event()
+        started = []
+
+        def handler(kind: str):
+            async def handle():
+                started.append(kind)
+                await release.wait()
+
+            return handle
+
+        for _ in range(scheduler.MAX_RUNNING_PER_MODULE * 2):
+            sched.submit(scheduler.WATCHER, "Module", handler("watcher"))
+
+        sched.submit(scheduler.COMMAND, "Module", handler("command"))
+        await asyncio.sleep(0)
+
+        assert "command" in started
+        assert sched.stats()["commands"] == {"running": 1, "queued": 0, "dropped": 0}
+
+        release.set()
+        while sched._tasks:
+            await asyncio.gather(*sched._tasks)
+
+        assert started.count("watcher") == scheduler.MAX_RUNNING_PER_MODULE * 2
+
+    asyncio.run(run())